@@ -1,8 +1,14 @@
 import streamlit as st
 from groq import Groq
-import PyPDF2
 import os
 from dotenv import load_dotenv
+from sofia.context import build_messages
+from sofia.groq_client import RateLimitedClient
+from sofia.history import ConversationSummary
+from sofia.pdf_loader import join_pages, load_pages
+from sofia.single_flight import CoalescingClient
+from sofia.streaming import CURSOR, ThrottledPlaceholder
+from sofia.transcript import render_transcript, reset_transcript
 
 # Cargar variables de entorno
 load_dotenv()
@@ -18,15 +24,21 @@ st.set_page_config(
 GROQ_API_KEY = "gsk_tu_api_key_aqui"  # Reemplaza con tu API key
 PDF_PATH = "guia_sop.pdf"  # Nombre de tu PDF
 MODEL = "llama-3.3-70b-versatile"
+PROMPT_TOKEN_BUDGET = 6000  # Máximo de tokens de entrada por pregunta (prompt + guía + historial)
+GUIDE_TOKEN_BUDGET = 2500  # Máximo de tokens de la guía dentro del prompt
+HISTORY_KEEP_TURNS = 2  # Turnos recientes que se envían completos; los anteriores se resumen
+MODEL_FALLBACK = True  # Si el modelo grande llega al límite de uso, responder con llama-3.1-8b-instant
 
 # Intentar obtener la API key de variables de entorno primero
 if os.getenv("GROQ_API_KEY"):
     GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 # Inicializar cliente de Groq
+# (un solo cliente por proceso: los límites de uso se comparten entre sesiones y
+# las peticiones idénticas de varias sesiones a la vez salen una sola vez)
 @st.cache_resource
 def init_client():
-    return Groq(api_key=GROQ_API_KEY)
+    return CoalescingClient(RateLimitedClient(Groq(api_key=GROQ_API_KEY, max_retries=0), fallback=MODEL_FALLBACK))
 
 client = init_client()
 
@@ -36,20 +48,16 @@ def load_pdf():
     if not os.path.exists(PDF_PATH):
         st.error(f"❌ No se encuentra el archivo: {PDF_PATH}")
         st.info("Asegúrate de que el PDF esté en la misma carpeta que este script")
-        return None
+        return None, []
     
     try:
-        with open(PDF_PATH, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+        pages = load_pages(PDF_PATH)
+        return join_pages(pages), pages
     except Exception as e:
         st.error(f"Error al leer el PDF: {str(e)}")
-        return None
+        return None, []
 
-pdf_content = load_pdf()
+pdf_content, pdf_pages = load_pdf()
 
 # Título
 st.title("💜 Guía Educativa sobre SOP")
@@ -89,6 +97,9 @@ with st.sidebar:
     
     if st.button("🗑️ Nueva conversación"):
         st.session_state.messages = []
+        if "summary" in st.session_state:
+            st.session_state.summary.reset()
+        reset_transcript()
         st.rerun()
 
 # Sistema de prompt
@@ -121,7 +132,7 @@ def create_prompt(pdf_content, location):
         prompt += f"""
 📚 GUÍA CIENTÍFICA (usa SOLO esta información):
 
-{pdf_content[:10000]}
+{pdf_content}
 
 Basa TODAS tus respuestas en esta guía.
 """
@@ -138,6 +149,10 @@ Si busca profesionales, sugiere búsquedas locales en Google, directorios médic
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Resumen de los turnos viejos (se actualiza en segundo plano con un modelo barato)
+if "summary" not in st.session_state:
+    st.session_state.summary = ConversationSummary(client, keep_turns=HISTORY_KEEP_TURNS)
+
 # Mensaje de bienvenida
 if len(st.session_state.messages) == 0:
     welcome = """¡Hola! 👋 Me da mucho gusto que estés aquí.
@@ -152,10 +167,8 @@ Puedes preguntarme sobre:
     
     st.session_state.messages.append({"role": "assistant", "content": welcome})
 
-# Mostrar mensajes
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+# Mostrar mensajes (solo los últimos; los anteriores detrás de un botón)
+render_transcript(st.session_state.messages)
 
 # Input usuario
 if prompt := st.chat_input("Escribe tu pregunta... 💭"):
@@ -170,17 +183,24 @@ if prompt := st.chat_input("Escribe tu pregunta... 💭"):
         st.markdown(prompt)
     
     with st.chat_message("assistant"):
-        placeholder = st.empty()
+        # Agrupa los fragmentos: actualizar en cada uno reenvía toda la respuesta
+        placeholder = ThrottledPlaceholder(st.empty())
         full_response = ""
         
         try:
-            system_prompt = create_prompt(pdf_content, user_location)
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            for msg in st.session_state.messages[-10:]:
-                if msg["role"] != "system":
-                    messages.append({"role": msg["role"], "content": msg["content"]})
+            # La guía y el historial se recortan al presupuesto de tokens
+            summary, recent_messages = st.session_state.summary.compact(st.session_state.messages)
+            messages = build_messages(
+                lambda context: create_prompt(context, user_location),
+                pdf_pages,
+                recent_messages,
+                MODEL,
+                PROMPT_TOKEN_BUDGET,
+                max_tokens=max_tokens,
+                context_budget=GUIDE_TOKEN_BUDGET,
+                join=join_pages,
+                summary=summary
+            )
             
             stream = client.chat.completions.create(
                 model=MODEL,
@@ -193,16 +213,17 @@ if prompt := st.chat_input("Escribe tu pregunta... 💭"):
             for chunk in stream:
                 if chunk.choices[0].delta.content:
                     full_response += chunk.choices[0].delta.content
-                    placeholder.markdown(full_response + "▌")
+                    placeholder.markdown(full_response + CURSOR)
             
-            placeholder.markdown(full_response)
+            placeholder.flush(full_response)
             
         except Exception as e:
             full_response = f"Error: {str(e)}"
-            placeholder.markdown(full_response)
+            placeholder.flush(full_response)
     
     if full_response:
         st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.summary.update_async(st.session_state.messages)
 
 # Footer
 st.markdown("---")
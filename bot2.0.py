@@ -1,14 +1,28 @@
 import streamlit as st
 from groq import Groq
-import PyPDF2
 import os
 from dotenv import load_dotenv
-import re
-import time
+from sofia.answer_cache import AnswerCache
+from sofia.context import build_messages
+from sofia.groq_client import RateLimitedClient
+from sofia.history import ConversationSummary
+from sofia.normalize import analyze
+from sofia.pdf_loader import join_pages, load_pages, pdf_hash
+from sofia.prompts import OFF_TOPIC_REPLY
+from sofia.retrieval import KEYWORDS
+from sofia.single_flight import CoalescingClient
+from sofia.streaming import stream_completion
+from sofia.telemetry import configure_logging
+from sofia.topic_filter import TopicFilter
+from sofia.topics import TOPICS
+from sofia.transcript import render_transcript, reset_transcript
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Streamlit no configura el logging: sin esto se pierden las decisiones del filtro de tema
+configure_logging()
+
 # Configuración de la página
 st.set_page_config(
     page_title="Guía Educativa SOP",
@@ -20,15 +34,24 @@ st.set_page_config(
 GROQ_API_KEY = "gsk_tu_api_key_aqui"  # Reemplaza con tu API key
 PDF_PATH = "guia_sop.pdf"  # Nombre de tu PDF
 MODEL = "llama-3.3-70b-versatile"  # El mejor modelo actual en Groq
+TYPING_EFFECT = True  # Mostrar la respuesta palabra por palabra (no añade espera)
+PROMPT_VERSION = "sofia-2.0-2"  # Súbelo si cambias create_prompt: invalida las respuestas guardadas
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # Segundos que vale una respuesta guardada de un tema guiado
+PROMPT_TOKEN_BUDGET = 8000  # Máximo de tokens de entrada por pregunta (prompt + guía + historial)
+GUIDE_TOKEN_BUDGET = 3750  # Máximo de tokens de la guía dentro del prompt
+HISTORY_KEEP_TURNS = 2  # Turnos recientes que se envían completos; los anteriores se resumen
+MODEL_FALLBACK = True  # Si el modelo grande llega al límite de uso, responder con llama-3.1-8b-instant
 
 # Intentar obtener la API key de variables de entorno primero
 if os.getenv("GROQ_API_KEY"):
     GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 # Inicializar cliente de Groq
+# (un solo cliente por proceso: los límites de uso se comparten entre sesiones y
+# las peticiones idénticas de varias sesiones a la vez salen una sola vez)
 @st.cache_resource
 def init_client():
-    return Groq(api_key=GROQ_API_KEY)
+    return CoalescingClient(RateLimitedClient(Groq(api_key=GROQ_API_KEY, max_retries=0), fallback=MODEL_FALLBACK))
 
 client = init_client()
 
@@ -38,46 +61,39 @@ def load_pdf():
     if not os.path.exists(PDF_PATH):
         st.error(f"❌ No se encuentra el archivo: {PDF_PATH}")
         st.info("Asegúrate de que el PDF esté en la misma carpeta que este script")
-        return None
+        return None, []
     
     try:
-        with open(PDF_PATH, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            return text
+        pages = load_pages(PDF_PATH)
+        return join_pages(pages), pages
     except Exception as e:
         st.error(f"Error al leer el PDF: {str(e)}")
-        return None
+        return None, []
 
 # Extraer temas/secciones del PDF - AHORA EN ESPAÑOL
 @st.cache_data
 def extract_topics(pdf_text):
     """Extrae temas principales del PDF"""
     
-    topics = {
-        "🔍 ¿Qué es el SOP?": "Explícame qué es el Síndrome de Ovario Poliquístico",
-        "🩺 ¿Cómo se diagnostica?": "¿Cómo sé si tengo SOP? ¿Qué exámenes necesito?",
-        "💊 Opciones de tratamiento": "¿Cuáles son los tratamientos disponibles para el SOP?",
-        "🥗 Alimentación saludable": "¿Qué debo comer si tengo SOP?",
-        "🏃‍♀️ Actividad física": "¿Qué tipo de ejercicio me ayuda con el SOP?",
-        "⚖️ Manejo del peso": "Tengo dificultad para bajar de peso, ¿qué puedo hacer?",
-        "💉 Resistencia a la insulina": "¿Qué es la resistencia a la insulina en el SOP?",
-        "🤰 Fertilidad y embarazo": "Quiero tener hijos, ¿el SOP afecta mi fertilidad?",
-        "💇‍♀️ Acné y vello excesivo": "¿Cómo manejo el acné y el exceso de vello?",
-        "📅 Períodos irregulares": "Mis períodos son irregulares, ¿es normal?",
-        "🧠 Salud emocional": "Me siento triste o ansiosa, ¿tiene relación con el SOP?",
-        "❤️ Salud del corazón": "¿Debo preocuparme por mi salud cardiovascular?",
-        "🩸 Diabetes y SOP": "¿Tengo mayor riesgo de diabetes?",
-        "💊 Anticonceptivos": "¿Los anticonceptivos ayudan con el SOP?",
-        "🌿 Suplementos naturales": "¿Hay suplementos que puedan ayudarme?",
-    }
+    topics = dict(TOPICS)
     
     return topics
 
-pdf_content = load_pdf()
+# Filtro local de preguntas fuera de tema (vocabulario de la guía y palabras clave)
+@st.cache_resource
+def load_topic_filter(guide_hash, _pages):
+    return TopicFilter((analyze(page) for page in _pages), KEYWORDS)
+
+# Hash de la guía para la caché de respuestas
+@st.cache_data
+def get_guide_hash():
+    return pdf_hash(PDF_PATH) if os.path.exists(PDF_PATH) else ""
+
+pdf_content, pdf_pages = load_pdf()
 topics = extract_topics(pdf_content) if pdf_content else {}
+guide_hash = get_guide_hash()
+answer_cache = AnswerCache(ttl=ANSWER_CACHE_TTL)
+topic_filter = load_topic_filter(guide_hash, pdf_pages)
 
 # Título
 st.title("💜 Guía Educativa sobre SOP")
@@ -135,7 +151,6 @@ with st.sidebar:
             topic_question = topics[selected_topic]
             st.session_state.messages.append({"role": "user", "content": topic_question})
             st.session_state.pending_response = topic_question
-            st.rerun()
     
     st.markdown("---")
     
@@ -167,6 +182,9 @@ with st.sidebar:
     
     if st.button("🗑️ Nueva conversación"):
         st.session_state.messages = []
+        if "summary" in st.session_state:
+            st.session_state.summary.reset()
+        reset_transcript()
         st.rerun()
 
 # Sistema de prompt MEJORADO - MÁS HUMANO Y EMPÁTICO
@@ -223,7 +241,7 @@ EJEMPLOS DE TU TONO:
 📚 TU FUENTE DE INFORMACIÓN:
 Esta es tu ÚNICA fuente de información médica. Todo lo que compartas debe basarse en este contenido:
 
-{pdf_content[:15000]}
+{pdf_content}
 
 IMPORTANTE: 
 - Si te preguntan algo que NO está en la guía, sé honesta: "Esa pregunta específica no la cubre la guía que tengo. Lo mejor sería que lo consultes con tu médico, ya que es un tema importante"
@@ -233,33 +251,14 @@ IMPORTANTE:
     
     return prompt
 
-# Función para simular escritura más natural
-def stream_with_delay(text, placeholder):
-    """Simula una escritura más humana con pausas naturales"""
-    words = text.split()
-    displayed_text = ""
-    
-    for i, word in enumerate(words):
-        displayed_text += word + " "
-        
-        # Pausas más largas después de puntos y comas
-        if word.endswith('.') or word.endswith('?') or word.endswith('!'):
-            time.sleep(0.08)
-        elif word.endswith(','):
-            time.sleep(0.04)
-        else:
-            time.sleep(0.02)
-        
-        # Actualizar cada pocas palabras para parecer más natural
-        if i % 3 == 0:
-            placeholder.markdown(displayed_text + "▌")
-    
-    return displayed_text
-
 # Inicializar chat
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Resumen de los turnos viejos (se actualiza en segundo plano con un modelo barato)
+if "summary" not in st.session_state:
+    st.session_state.summary = ConversationSummary(client, keep_turns=HISTORY_KEEP_TURNS)
+
 if "pending_response" not in st.session_state:
     st.session_state.pending_response = None
 
@@ -282,10 +281,8 @@ Estoy aquí para acompañarte, responder tus dudas, y darte información clara y
     
     st.session_state.messages.append({"role": "assistant", "content": welcome})
 
-# Mostrar mensajes
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+# Mostrar mensajes (solo los últimos; los anteriores detrás de un botón)
+render_transcript(st.session_state.messages)
 
 # Procesar respuesta pendiente de botón clickeado
 if st.session_state.pending_response and pdf_content:
@@ -296,38 +293,52 @@ if st.session_state.pending_response and pdf_content:
         placeholder = st.empty()
         full_response = ""
         
-        try:
-            system_prompt = create_prompt(pdf_content)
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Incluir historial
-            for msg in st.session_state.messages[-10:]:
-                if msg["role"] != "system":
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            # Generar respuesta
-            completion = client.chat.completions.create(
-                model=model_selector,
-                messages=messages,
-                temperature=0.7,
-                max_tokens=2048,
-                stream=False
-            )
-            
-            full_response = completion.choices[0].message.content
-            
-            # Mostrar con delay natural
-            displayed = stream_with_delay(full_response, placeholder)
-            placeholder.markdown(displayed)
-            
-        except Exception as e:
-            full_response = f"Disculpa, tuve un problemita técnico 😅 ¿Podrías intentar de nuevo?\n\nError: {str(e)}"
+        # La caché de temas es compartida: solo se guardan respuestas sin historial de esta sesión
+        first_turn = sum(message["role"] == "user" for message in st.session_state.messages) == 1
+        
+        # Los temas guiados pueden tener la respuesta ya calculada
+        cached_answer = answer_cache.get(prompt_to_process, model_selector, guide_hash, PROMPT_VERSION)
+        if cached_answer:
+            full_response = cached_answer
             placeholder.markdown(full_response)
+        else:
+            try:
+                # Guía e historial recortados al presupuesto de tokens
+                summary, recent_messages = st.session_state.summary.compact(st.session_state.messages)
+                messages = build_messages(
+                    create_prompt,
+                    pdf_pages,
+                    recent_messages,
+                    model_selector,
+                    PROMPT_TOKEN_BUDGET,
+                    max_tokens=2048,
+                    context_budget=GUIDE_TOKEN_BUDGET,
+                    join=join_pages,
+                    summary=summary
+                )
+                
+                # Generar respuesta en streaming
+                full_response, stats = stream_completion(
+                    client,
+                    placeholder,
+                    typing_effect=TYPING_EFFECT,
+                    model=model_selector,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=2048
+                )
+                # Si respondió el modelo de respaldo, la respuesta no es del modelo elegido
+                if first_turn and stats["model"] == model_selector:
+                    answer_cache.put(prompt_to_process, model_selector, guide_hash, PROMPT_VERSION, full_response)
+                
+            except Exception as e:
+                full_response = f"Disculpa, tuve un problemita técnico 😅 ¿Podrías intentar de nuevo?\n\nError: {str(e)}"
+                placeholder.markdown(full_response)
     
     # Agregar respuesta al historial
     if full_response:
         st.session_state.messages.append({"role": "assistant", "content": full_response})
-        st.rerun()  # Refrescar para mostrar correctamente
+        st.session_state.summary.update_async(st.session_state.messages)
 
 # Input usuario - LA BARRA SIEMPRE ESTÁ DISPONIBLE
 if prompt := st.chat_input("Escribe aquí tu pregunta o inquietud... 💭"):
@@ -346,37 +357,45 @@ if prompt := st.chat_input("Escribe aquí tu pregunta o inquietud... 💭"):
         placeholder = st.empty()
         full_response = ""
         
-        try:
-            system_prompt = create_prompt(pdf_content)
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            # Últimos 10 mensajes para contexto
-            for msg in st.session_state.messages[-10:]:
-                if msg["role"] != "system":
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            # Obtener respuesta completa primero
-            completion = client.chat.completions.create(
-                model=model_selector,
-                messages=messages,
-                temperature=0.7,  # Más creatividad para respuestas naturales
-                max_tokens=2048,
-                stream=False  # No streaming para controlar velocidad
-            )
-            
-            full_response = completion.choices[0].message.content
-            
-            # Mostrar con delay natural
-            displayed = stream_with_delay(full_response, placeholder)
-            placeholder.markdown(displayed)
-            
-        except Exception as e:
-            full_response = f"Disculpa, tuve un problemita técnico 😅 ¿Podrías intentar de nuevo? Si el error persiste, me gustaría que lo reportaras.\n\nError: {str(e)}"
+        follow_up = sum(message["role"] == "user" for message in st.session_state.messages) > 1
+        if not topic_filter.check(prompt, follow_up)[0]:
+            # Claramente fuera del SOP: la negativa fija, sin llamar al modelo
+            full_response = OFF_TOPIC_REPLY
             placeholder.markdown(full_response)
+        else:
+            try:
+                # Guía e historial reciente recortados al presupuesto de tokens
+                summary, recent_messages = st.session_state.summary.compact(st.session_state.messages)
+                messages = build_messages(
+                    create_prompt,
+                    pdf_pages,
+                    recent_messages,
+                    model_selector,
+                    PROMPT_TOKEN_BUDGET,
+                    max_tokens=2048,
+                    context_budget=GUIDE_TOKEN_BUDGET,
+                    join=join_pages,
+                    summary=summary
+                )
+                
+                # Mostrar la respuesta mientras se genera
+                full_response, _ = stream_completion(
+                    client,
+                    placeholder,
+                    typing_effect=TYPING_EFFECT,
+                    model=model_selector,
+                    messages=messages,
+                    temperature=0.7,  # Más creatividad para respuestas naturales
+                    max_tokens=2048
+                )
+                
+            except Exception as e:
+                full_response = f"Disculpa, tuve un problemita técnico 😅 ¿Podrías intentar de nuevo? Si el error persiste, me gustaría que lo reportaras.\n\nError: {str(e)}"
+                placeholder.markdown(full_response)
     
     if full_response:
         st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.summary.update_async(st.session_state.messages)
 
 # Footer
 st.markdown("---")
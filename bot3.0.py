@@ -1,13 +1,28 @@
 import streamlit as st
-from groq import Groq
-import PyPDF2
+from groq import Groq, RateLimitError
 import os
 from dotenv import load_dotenv
-import time
+from sofia.answer_cache import AnswerCache
+from sofia.groq_client import RateLimitedClient
+from sofia.history import ConversationSummary
+from sofia.pipeline import ChatPipeline
+from sofia.prefetch import SpeculativeAnswer
+from sofia.prompts import OFF_TOPIC_REPLY, PROMPT_VERSION
+from sofia.question_cache import QuestionCache
+from sofia.router import AUTO_MODEL, ModelRouter
+from sofia.single_flight import CoalescingClient
+from sofia.streaming import stream_completion
+from sofia.telemetry import METRICS_PORT, TELEMETRY, configure_logging, stage, start_metrics_server
+from sofia.tokens import count_message_tokens, count_tokens
+from sofia.topics import TOPICS
+from sofia.transcript import render_transcript, reset_transcript
 
 # Cargar variables de entorno
 load_dotenv()
 
+# Streamlit no configura el logging: sin esto se pierden los registros de cada turno
+configure_logging()
+
 # Configuración de la página
 st.set_page_config(
     page_title="Guía Educativa SOP",
@@ -19,106 +34,83 @@ st.set_page_config(
 GROQ_API_KEY = "gsk_tu_api_key_aqui"  # Reemplaza con tu API key
 PDF_PATH = "guia_sop.pdf"  # Nombre de tu PDF
 MODEL = "llama-3.3-70b-versatile"
+TYPING_EFFECT = True  # Mostrar la respuesta palabra por palabra (no añade espera)
+CHUNK_SIZE = 1200  # Máximo de caracteres por chunk del PDF
+CHUNK_OVERLAP = 200  # Caracteres que se repiten entre chunks consecutivos
+CHUNK_MAX_TOKENS = 350  # Máximo de tokens por chunk
+ANSWER_CACHE_TTL = 7 * 24 * 3600  # Segundos que vale una respuesta guardada de un tema guiado
+RETRIEVAL_TOP_K = 6  # Chunks candidatos por pregunta (el presupuesto decide cuántos entran)
+RETRIEVAL_BACKEND = "bm25"  # "bm25" o "tfidf" (matriz NumPy en disco, para bibliotecas de varias guías)
+CONTEXT_COMPRESSION = True  # Enviar solo las oraciones de la guía que responden la pregunta
+PROMPT_TOKEN_BUDGET = 6000  # Máximo de tokens de entrada por pregunta (prompt + guía + historial)
+GUIDE_TOKEN_BUDGET = 1500  # Máximo de tokens de la guía dentro del prompt
+HISTORY_KEEP_TURNS = 2  # Turnos recientes que se envían completos; los anteriores se resumen
+MODEL_FALLBACK = True  # Si el modelo grande llega al límite de uso, responder con llama-3.1-8b-instant
+SPECULATIVE_PREFETCH = False  # Empezar a responder el tema guiado en cuanto se selecciona, antes de pulsar "Preguntar"
+QUESTION_CACHE_SIZE = 512  # Preguntas de primer turno cuya respuesta se reutiliza para preguntas casi iguales
 
 # Intentar obtener la API key de variables de entorno primero
 if os.getenv("GROQ_API_KEY"):
     GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 # Inicializar cliente de Groq
+# (un solo cliente por proceso: los límites de uso se comparten entre sesiones y
+# las peticiones idénticas de varias sesiones a la vez salen una sola vez)
 @st.cache_resource
 def init_client():
-    return Groq(api_key=GROQ_API_KEY)
+    return CoalescingClient(RateLimitedClient(Groq(api_key=GROQ_API_KEY, max_retries=0), fallback=MODEL_FALLBACK))
 
 client = init_client()
 
-# Cargar el PDF y dividir en chunks
-@st.cache_data
-def load_and_chunk_pdf():
+# Métricas de Prometheus en SOFIA_METRICS_PORT (un servidor por proceso)
+@st.cache_resource
+def init_metrics():
+    return start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+
+init_metrics()
+
+# Cargar el PDF, dividirlo en chunks e indexarlo (una sola vez por proceso)
+@st.cache_resource
+def load_pipeline():
     if not os.path.exists(PDF_PATH):
         st.error(f"❌ No se encuentra el archivo: {PDF_PATH}")
-        return None, []
+        return None
     
     try:
-        with open(PDF_PATH, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-        
-        # Dividir en chunks de ~2000 caracteres
-        chunk_size = 2000
-        chunks = []
-        for i in range(0, len(text), chunk_size):
-            chunk = text[i:i+chunk_size]
-            if chunk.strip():
-                chunks.append(chunk)
-        
-        return text, chunks
+        return ChatPipeline(
+            PDF_PATH,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            chunk_max_tokens=CHUNK_MAX_TOKENS,
+            top_k=RETRIEVAL_TOP_K,
+            prompt_budget=PROMPT_TOKEN_BUDGET,
+            guide_budget=GUIDE_TOKEN_BUDGET,
+            max_tokens=2048,
+            backend=RETRIEVAL_BACKEND,
+            compress=CONTEXT_COMPRESSION
+        )
     except Exception as e:
         st.error(f"Error al leer el PDF: {str(e)}")
-        return None, []
+        return None
 
-# Buscar chunks relevantes basado en la pregunta
-def find_relevant_chunks(query, chunks, client, top_k=3):
-    """Busca los chunks más relevantes para la pregunta usando embeddings simulados"""
-    if not chunks:
-        return []
-    
-    # Si la pregunta tiene keywords específicos, buscar por keyword
-    query_lower = query.lower()
-    keywords = {
-        'diagnóstico': ['diagnóstico', 'criterios', 'rotterdam', 'examen'],
-        'tratamiento': ['tratamiento', 'medicamento', 'terapia'],
-        'dieta': ['dieta', 'alimentación', 'comida', 'nutrición'],
-        'ejercicio': ['ejercicio', 'actividad física', 'deporte'],
-        'peso': ['peso', 'obesidad', 'adelgazar'],
-        'fertilidad': ['fertilidad', 'embarazo', 'bebé', 'concepción'],
-        'síntomas': ['síntomas', 'signos', 'manifestaciones'],
-        'insulina': ['insulina', 'glucosa', 'diabetes'],
-        'mental': ['depresión', 'ansiedad', 'emocional', 'psicológico'],
-        'anticonceptivos': ['anticonceptivos', 'píldora', 'hormonal']
-    }
-    
-    # Encontrar categoría relevante
-    relevant_keywords = []
-    for category, words in keywords.items():
-        if any(word in query_lower for word in words):
-            relevant_keywords.extend(words)
-    
-    # Buscar chunks que contengan keywords relevantes
-    scored_chunks = []
-    for chunk in chunks:
-        chunk_lower = chunk.lower()
-        score = sum(1 for keyword in relevant_keywords if keyword in chunk_lower)
-        if score > 0:
-            scored_chunks.append((score, chunk))
-    
-    # Ordenar por relevancia
-    scored_chunks.sort(reverse=True, key=lambda x: x[0])
-    
-    # Retornar top_k chunks más relevantes
-    return [chunk for score, chunk in scored_chunks[:top_k]]
+pipeline = load_pipeline()
+pdf_content = pipeline.pdf_content if pipeline else None
+pdf_chunks = pipeline.chunks if pipeline else []
+guide_hash = pipeline.guide_hash if pipeline else ""
+answer_cache = AnswerCache(ttl=ANSWER_CACHE_TTL)
+router = ModelRouter()
+
+# Respuestas de primer turno compartidas entre sesiones (en memoria, una por proceso).
+# Si cambia la guía o el prompt, las guardadas dejan de servir
+@st.cache_resource
+def load_question_cache():
+    return QuestionCache(capacity=QUESTION_CACHE_SIZE)
 
-pdf_content, pdf_chunks = load_and_chunk_pdf()
+question_cache = load_question_cache()
+question_cache.invalidate(guide_hash, PROMPT_VERSION)
 
 # Temas predefinidos
-topics = {
-    "🔍 ¿Qué es el SOP?": "Explícame qué es el Síndrome de Ovario Poliquístico",
-    "🩺 ¿Cómo se diagnostica?": "¿Cómo sé si tengo SOP? ¿Qué exámenes necesito?",
-    "💊 Opciones de tratamiento": "¿Cuáles son los tratamientos disponibles para el SOP?",
-    "🥗 Alimentación saludable": "¿Qué debo comer si tengo SOP?",
-    "🏃‍♀️ Actividad física": "¿Qué tipo de ejercicio me ayuda con el SOP?",
-    "⚖️ Manejo del peso": "Tengo dificultad para bajar de peso, ¿qué puedo hacer?",
-    "💉 Resistencia a la insulina": "¿Qué es la resistencia a la insulina en el SOP?",
-    "🤰 Fertilidad y embarazo": "Quiero tener hijos, ¿el SOP afecta mi fertilidad?",
-    "💇‍♀️ Acné y vello excesivo": "¿Cómo manejo el acné y el exceso de vello?",
-    "📅 Períodos irregulares": "Mis períodos son irregulares, ¿es normal?",
-    "🧠 Salud emocional": "Me siento triste o ansiosa, ¿tiene relación con el SOP?",
-    "❤️ Salud del corazón": "¿Debo preocuparme por mi salud cardiovascular?",
-    "🩸 Diabetes y SOP": "¿Tengo mayor riesgo de diabetes?",
-    "💊 Anticonceptivos": "¿Los anticonceptivos ayudan con el SOP?",
-    "🌿 Suplementos naturales": "¿Hay suplementos que puedan ayudarme?",
-}
+topics = TOPICS
 
 # Título
 st.markdown('<h1 style="color: #9b59b6; margin-bottom: 5px;">💜 Guía Educativa sobre SOP</h1>', unsafe_allow_html=True)
@@ -155,11 +147,13 @@ with st.sidebar:
     model_selector = st.selectbox(
         "Modelo de IA",
         [
+            AUTO_MODEL,
             "llama-3.3-70b-versatile",
             "llama-3.1-70b-versatile",
             "llama-3.1-8b-instant"
         ],
-        index=0
+        index=0,
+        format_func=lambda model: "Automático (70B u 8B según la pregunta)" if model == AUTO_MODEL else model
     )
     
     st.markdown("---")
@@ -179,7 +173,6 @@ with st.sidebar:
             topic_question = topics[selected_topic]
             st.session_state.messages.append({"role": "user", "content": topic_question})
             st.session_state.pending_response = topic_question
-            st.rerun()
     
     st.markdown("---")
     
@@ -210,74 +203,29 @@ with st.sidebar:
     
     if st.button("🗑️ Nueva conversación"):
         st.session_state.messages = []
+        if "summary" in st.session_state:
+            st.session_state.summary.reset()
+        reset_transcript()
         st.session_state.pending_response = None
+        if "prefetch" in st.session_state:
+            st.session_state.prefetch.cancel()
         st.rerun()
 
-# Prompt mejorado con restricciones ESTRICTAS
-def create_prompt(relevant_context):
-    prompt = f"""Eres Sofía, una guía educativa especializada EXCLUSIVAMENTE en el Síndrome de Ovario Poliquístico (SOP).
-
-🚨 RESTRICCIONES ABSOLUTAS:
-
-1. **SOLO hablas de SOP**: Si te preguntan sobre CUALQUIER otro tema (física, otros problemas de salud, hombres, etc.), debes responder:
-   "Lo siento, solo puedo ayudarte con información sobre el Síndrome de Ovario Poliquístico (SOP) en mujeres. Para otras consultas médicas o temas, te recomiendo consultar con un profesional de salud apropiado. ¿Tienes alguna pregunta sobre el SOP? 😊"
-
-2. **SOP es EXCLUSIVO de mujeres**: Si un hombre pregunta si tiene SOP, responde amablemente que el SOP es una condición que SOLO afecta a mujeres y que debe consultar con su médico para sus síntomas específicos.
-
-3. **SOLO usas la información del contexto proporcionado**: NO inventes, NO uses conocimiento general. Si la información NO está en el contexto, di: "Esa información específica no está en la guía que tengo disponible. Te recomiendo consultar con tu ginecólogo o endocrinólogo para esa pregunta específica."
-
-4. **NUNCA das diagnósticos ni prescribes tratamientos**: Siempre diriges a consultar profesionales.
-
-📚 CONTEXTO DE LA GUÍA (tu ÚNICA fuente):
-
-{relevant_context}
-
-💬 TU FORMA DE COMUNICARTE:
-- Cálida, empática y comprensiva
-- Natural y conversacional
-- Usa ejemplos simples
-- Valida emociones
-- Positiva pero realista
-- Ocasionalmente usa emojis 💜
-
-✅ ESTRUCTURA DE RESPUESTAS:
-1. Empatía/Validación inicial
-2. Información del contexto
-3. Explicación clara
-4. Pasos o sugerencias prácticas
-5. Cierre motivador
-
-RECUERDA: Si la pregunta NO es sobre SOP, RECHAZA amablemente y redirige. NO contestes sobre otros temas."""
-
-    return prompt
-
-# Función para simular escritura natural
-def stream_with_delay(text, placeholder):
-    words = text.split()
-    displayed_text = ""
-    
-    for i, word in enumerate(words):
-        displayed_text += word + " "
-        
-        if word.endswith('.') or word.endswith('?') or word.endswith('!'):
-            time.sleep(0.08)
-        elif word.endswith(','):
-            time.sleep(0.04)
-        else:
-            time.sleep(0.02)
-        
-        if i % 3 == 0:
-            placeholder.markdown(displayed_text + "▌")
-    
-    return displayed_text
-
 # Inicializar chat
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+# Resumen de los turnos viejos (se actualiza en segundo plano con un modelo barato)
+if "summary" not in st.session_state:
+    st.session_state.summary = ConversationSummary(client, keep_turns=HISTORY_KEEP_TURNS)
+
 if "pending_response" not in st.session_state:
     st.session_state.pending_response = None
 
+# Respuesta anticipada del tema seleccionado (ver SPECULATIVE_PREFETCH)
+if "prefetch" not in st.session_state:
+    st.session_state.prefetch = SpeculativeAnswer(client)
+
 # Mensaje de bienvenida
 if len(st.session_state.messages) == 0:
     welcome = """¡Hola! Me llamo Sofía 💜
@@ -290,10 +238,93 @@ Estoy aquí para ayudarte a entender mejor el **Síndrome de Ovario Poliquístic
     
     st.session_state.messages.append({"role": "assistant", "content": welcome})
 
-# Mostrar mensajes
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.markdown(msg["content"])
+# Mostrar mensajes (solo los últimos; los anteriores detrás de un botón)
+render_transcript(st.session_state.messages)
+
+def choose_model(question, turn=None):
+    """Modelo para la pregunta: el del menú o, en modo automático, el que elige el router.
+
+    Devuelve ``(modelo, chunks)``: los chunks que buscó el router se pasan a
+    ``build_messages`` para no buscarlos dos veces (``None`` sin router).
+    """
+    if model_selector != AUTO_MODEL:
+        return model_selector, None
+    history_turns = sum(message["role"] == "user" for message in st.session_state.messages) - 1
+    with stage(turn, "retrieve"):
+        chunks = pipeline.retrieve(question)
+    with stage(turn, "route"):
+        model, _ = router.route(question, chunks, history_turns)
+    return model, chunks
+
+def answer_with(placeholder, model, messages, turn=None):
+    """Transmite la respuesta; si la del modelo pequeño no pasa las comprobaciones, la pide al grande.
+
+    Devuelve ``(respuesta, modelo pedido, modelo que respondió)``: si el pedido
+    llegó al límite de uso responde el de respaldo.
+    """
+    full_response, stats = stream_completion(
+        client,
+        placeholder,
+        typing_effect=TYPING_EFFECT,
+        turn=turn,
+        model=model,
+        messages=messages,
+        temperature=0.6,
+        max_tokens=2048
+    )
+    if model_selector == AUTO_MODEL and router.should_retry(model, full_response, stats["model"]):
+        model = router.large
+        full_response, stats = stream_completion(
+            client,
+            placeholder,
+            typing_effect=TYPING_EFFECT,
+            turn=turn,
+            model=model,
+            messages=messages,
+            temperature=0.6,
+            max_tokens=2048
+        )
+    return full_response, model, stats["model"]
+
+def cached_topic_answer(question, model):
+    """Respuesta guardada de un tema guiado (en modo automático vale también la del modelo grande)"""
+    cached_answer = answer_cache.get(question, model, guide_hash, PROMPT_VERSION)
+    if not cached_answer and model_selector == AUTO_MODEL:
+        cached_answer = answer_cache.get(question, router.large, guide_hash, PROMPT_VERSION)
+    return cached_answer
+
+def finish_turn(turn, outcome, model=None, messages=None, answer=""):
+    """Registra el turno en la telemetría con sus tokens de entrada y salida"""
+    turn.finish(
+        outcome=outcome,
+        model=model,
+        prompt_tokens=count_message_tokens(messages, model) if messages else 0,
+        completion_tokens=count_tokens(answer, model) if answer and outcome == "answered" else 0
+    )
+
+# Anticipar la respuesta del tema seleccionado mientras la usuaria pulsa "Preguntar".
+# La clave incluye el largo de la conversación: si cambia, la anticipación no sirve.
+# El modelo se elige una sola vez, al anticipar, y se reutiliza al pulsar el botón
+if SPECULATIVE_PREFETCH and pdf_chunks and not st.session_state.pending_response:
+    if selected_topic != "Selecciona un tema...":
+        topic_question = topics[selected_topic]
+        topic_key = (topic_question, model_selector, len(st.session_state.messages) + 1)
+        topic_model, topic_chunks = st.session_state.prefetch.model(topic_key), None
+        if not topic_model:
+            topic_model, topic_chunks = choose_model(topic_question)
+        if not cached_topic_answer(topic_question, topic_model):
+            topic_history = st.session_state.messages + [{"role": "user", "content": topic_question}]
+            topic_summary, topic_recent = st.session_state.summary.compact(topic_history)
+            st.session_state.prefetch.start(
+                topic_key,
+                lambda: pipeline.build_messages(topic_recent, topic_model, summary=topic_summary,
+                                                chunks=topic_chunks),
+                model=topic_model,
+                temperature=0.6,
+                max_tokens=2048
+            )
+    else:
+        st.session_state.prefetch.cancel()
 
 # Procesar respuesta pendiente de botón
 if st.session_state.pending_response and pdf_chunks:
@@ -303,49 +334,69 @@ if st.session_state.pending_response and pdf_chunks:
     with st.chat_message("assistant"):
         placeholder = st.empty()
         full_response = ""
+        turn = TELEMETRY.turn(source="topic")
+        # La caché de temas es compartida: solo se guardan respuestas sin historial de esta sesión
+        first_turn = sum(message["role"] == "user" for message in st.session_state.messages) == 1
         
-        try:
-            # Buscar contexto relevante
-            relevant_chunks = find_relevant_chunks(prompt_to_process, pdf_chunks, client)
-            context = "\n\n".join(relevant_chunks) if relevant_chunks else pdf_content[:8000]
-            
-            system_prompt = create_prompt(context)
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            for msg in st.session_state.messages[-10:]:
-                if msg["role"] != "system":
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-            
+        # Los temas guiados pueden tener la respuesta ya calculada o anticipada
+        # (con el modelo elegido al anticipar: volver a elegirlo podría descartarla)
+        topic_key = (prompt_to_process, model_selector, len(st.session_state.messages))
+        model = st.session_state.prefetch.model(topic_key) if SPECULATIVE_PREFETCH else None
+        chunks = None
+        if not model:
+            model, chunks = choose_model(prompt_to_process, turn)
+        cached_answer = cached_topic_answer(prompt_to_process, model)
+        speculative_answer, messages, speculative_model = None, None, None
+        if not cached_answer and SPECULATIVE_PREFETCH:
+            speculative_answer, messages, speculative_model = st.session_state.prefetch.take(topic_key, placeholder)
+            if (speculative_answer and model_selector == AUTO_MODEL
+                    and router.should_retry(model, speculative_answer, speculative_model)):
+                speculative_answer = None
+        if cached_answer:
+            full_response = cached_answer
+            placeholder.markdown(full_response)
+            finish_turn(turn, "cached", model)
+        elif speculative_answer:
+            full_response = speculative_answer
+            placeholder.markdown(full_response)
+            # Una respuesta del modelo de respaldo no se guarda como si fuera del pedido
+            if first_turn and speculative_model == model:
+                answer_cache.put(prompt_to_process, model, guide_hash, PROMPT_VERSION, full_response)
+            finish_turn(turn, "speculative", speculative_model, messages)
+        else:
             try:
-                completion = client.chat.completions.create(
-                    model=model_selector,
-                    messages=messages,
-                    temperature=0.6,
-                    max_tokens=2048,
-                    stream=False
-                )
-                
-                full_response = completion.choices[0].message.content
-                displayed = stream_with_delay(full_response, placeholder)
-                placeholder.markdown(displayed)
+                # Buscar contexto relevante y recortar chunks e historial al presupuesto de tokens
+                if messages is None:
+                    summary, recent_messages = st.session_state.summary.compact(st.session_state.messages)
+                    messages = pipeline.build_messages(recent_messages, model, summary=summary, turn=turn,
+                                                      chunks=chunks)
                 
+                try:
+                    full_response, model, answered_model = answer_with(placeholder, model, messages, turn)
+                    if first_turn and answered_model == model:
+                        answer_cache.put(prompt_to_process, model, guide_hash, PROMPT_VERSION, full_response)
+                    finish_turn(turn, "answered", answered_model, messages, full_response)
+                    
+                except Exception as e:
+                    error_msg = str(e).lower()
+                    
+                    if isinstance(e, RateLimitError) or "quota" in error_msg:
+                        full_response = "⚠️ **De momento no puedo responder preguntas** - He alcanzado el límite de tokens. Intenta más tarde. 💜"
+                    else:
+                        full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)[:100]}"
+                    
+                    placeholder.markdown(full_response)
+                    finish_turn(turn, "error", model, messages)
+            
             except Exception as e:
-                error_msg = str(e).lower()
-                
-                if "rate_limit" in error_msg or "429" in error_msg or "quota" in error_msg:
-                    full_response = "⚠️ **De momento no puedo responder preguntas** - He alcanzado el límite de tokens. Intenta más tarde. 💜"
-                else:
-                    full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)[:100]}"
-                
+                full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)[:100]}"
                 placeholder.markdown(full_response)
-        
-        except Exception as e:
-            full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)[:100]}"
-            placeholder.markdown(full_response)
+                finish_turn(turn, "error", model)
     
     if full_response:
         st.session_state.messages.append({"role": "assistant", "content": full_response})
-        st.rerun()
+        st.session_state.summary.update_async(st.session_state.messages)
+
 # Input usuario
 if prompt := st.chat_input("Escribe aquí tu pregunta sobre SOP... 💭"):
     
@@ -354,6 +405,7 @@ if prompt := st.chat_input("Escribe aquí tu pregunta sobre SOP... 💭"):
         st.stop()
     
     st.session_state.messages.append({"role": "user", "content": prompt})
+    st.session_state.prefetch.cancel()
     
     with st.chat_message("user"):
         st.markdown(prompt)
@@ -361,42 +413,49 @@ if prompt := st.chat_input("Escribe aquí tu pregunta sobre SOP... 💭"):
     with st.chat_message("assistant"):
         placeholder = st.empty()
         full_response = ""
+        turn = TELEMETRY.turn(source="chat")
         
-        try:
-            # Buscar chunks relevantes usando RAG simple
-            relevant_chunks = find_relevant_chunks(prompt, pdf_chunks, client, top_k=3)
-            
-            # Si no hay chunks relevantes, usar el inicio del documento
-            if not relevant_chunks:
-                context = pdf_content[:8000]
-            else:
-                context = "\n\n".join(relevant_chunks)
-            
-            system_prompt = create_prompt(context)
-            messages = [{"role": "system", "content": system_prompt}]
-            
-            for msg in st.session_state.messages[-10:]:
-                if msg["role"] != "system":
-                    messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            completion = client.chat.completions.create(
-                model=model_selector,
-                messages=messages,
-                temperature=0.6,
-                max_tokens=2048,
-                stream=False
-            )
-            
-            full_response = completion.choices[0].message.content
-            displayed = stream_with_delay(full_response, placeholder)
-            placeholder.markdown(displayed)
-            
-        except Exception as e:
-            full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)}"
+        # Sin historial la respuesta solo depende de la pregunta: puede servir la de una casi igual.
+        # Con historial la pregunta sigue la conversación y no pasa por el filtro de tema
+        first_turn = sum(message["role"] == "user" for message in st.session_state.messages) == 1
+        with turn.stage("topic_filter"):
+            on_topic = pipeline.is_on_topic(prompt, follow_up=not first_turn)
+        cached_answer = None
+        if on_topic and first_turn:
+            with turn.stage("question_cache"):
+                cached_answer = question_cache.get(prompt, model_selector, guide_hash, PROMPT_VERSION)
+        if not on_topic:
+            # Claramente fuera del SOP: la negativa fija, sin llamar al modelo
+            full_response = OFF_TOPIC_REPLY
+            placeholder.markdown(full_response)
+            finish_turn(turn, "filtered")
+        elif cached_answer:
+            full_response = cached_answer
             placeholder.markdown(full_response)
+            finish_turn(turn, "cached", model_selector)
+        else:
+            model, messages = None, None
+            try:
+                # Buscar chunks relevantes con BM25 (si no hay, usar el inicio del documento).
+                # Chunks e historial se recortan al presupuesto de tokens
+                summary, recent_messages = st.session_state.summary.compact(st.session_state.messages)
+                model, chunks = choose_model(prompt, turn)
+                messages = pipeline.build_messages(recent_messages, model, summary=summary, turn=turn,
+                                                  chunks=chunks)
+                
+                full_response, model, answered_model = answer_with(placeholder, model, messages, turn)
+                if first_turn and answered_model == model:
+                    question_cache.put(prompt, model_selector, guide_hash, PROMPT_VERSION, full_response)
+                finish_turn(turn, "answered", answered_model, messages, full_response)
+                
+            except Exception as e:
+                full_response = f"Disculpa, tuve un error técnico 😅\n\nError: {str(e)}"
+                placeholder.markdown(full_response)
+                finish_turn(turn, "error", model, messages)
     
     if full_response:
         st.session_state.messages.append({"role": "assistant", "content": full_response})
+        st.session_state.summary.update_async(st.session_state.messages)
 
 # Footer
 st.markdown("---")
@@ -0,0 +1 @@
+"""Componentes compartidos por las apps de Sofía (bot.py, bot2.0.py y bot3.0.py)."""
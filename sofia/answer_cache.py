@@ -0,0 +1,126 @@
+"""Caché en disco de respuestas a preguntas fijas (los temas guiados).
+
+Cada respuesta se guarda en un archivo JSON cuya clave combina la pregunta, el
+modelo, el hash de la guía y la versión del prompt, así que cambiar cualquiera
+de ellos hace que la respuesta vieja ya no se use. Las respuestas además
+caducan tras ``ttl`` segundos.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from sofia.pdf_loader import CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_DIR = os.path.join(CACHE_DIR, "answers")
+DEFAULT_TTL = 7 * 24 * 3600  # Una semana
+
+
+def answer_key(question, model, guide_hash, prompt_version):
+    """Clave de caché de una respuesta"""
+    raw = "\x1f".join([" ".join(question.split()), model, guide_hash, prompt_version])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Respuestas precalculadas, una por archivo en ``cache_dir``"""
+
+    def __init__(self, cache_dir=ANSWER_CACHE_DIR, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                with open(path, encoding="utf-8") as file:
+                    yield path, json.load(file)
+            except (OSError, ValueError):
+                yield path, None
+
+    def get(self, question, model, guide_hash, prompt_version):
+        """Devuelve la respuesta guardada o ``None`` si no hay o ya caducó"""
+        path = self._path(answer_key(question, model, guide_hash, prompt_version))
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Respuesta en caché ilegible (%s): %s", path, e)
+            return None
+
+        if time.time() - entry["created"] > self.ttl:
+            return None
+        return entry["answer"]
+
+    def put(self, question, model, guide_hash, prompt_version, answer):
+        """Guarda una respuesta (escritura atómica, segura entre procesos)"""
+        entry = {
+            "question": question,
+            "model": model,
+            "guide_hash": guide_hash,
+            "prompt_version": prompt_version,
+            "created": time.time(),
+            "answer": answer,
+        }
+        path = self._path(answer_key(question, model, guide_hash, prompt_version))
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as file:
+                    json.dump(entry, file, ensure_ascii=False)
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning("No se pudo guardar la respuesta en caché: %s", e)
+
+    def invalidate(self, guide_hash=None, prompt_version=None, expired=True):
+        """Borra las respuestas de otra guía u otra versión del prompt, y las caducadas.
+
+        Sin argumentos solo borra las caducadas. Devuelve cuántas se borraron.
+        """
+        now = time.time()
+        removed = 0
+        for path, entry in self._entries():
+            stale = (
+                entry is None
+                or (guide_hash is not None and entry.get("guide_hash") != guide_hash)
+                or (prompt_version is not None and entry.get("prompt_version") != prompt_version)
+                or (expired and now - entry.get("created", 0) > self.ttl)
+            )
+            if stale:
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def clear(self):
+        """Borra todas las respuestas"""
+        removed = 0
+        for path, _ in self._entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
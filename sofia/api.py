@@ -0,0 +1,262 @@
+"""API HTTP de Sofía, independiente de Streamlit.
+
+Todas las peticiones comparten una sola guía indexada (``ChatPipeline``) y un
+solo cliente asíncrono de Groq con su pool de conexiones y sus límites de uso;
+las peticiones idénticas simultáneas salen una sola vez (``sofia.single_flight``).
+
+Uso::
+
+    python -m sofia.api --port 8000
+    uvicorn sofia.api:app --workers 2
+
+Endpoints:
+
+- ``GET /health``: estado del servicio.
+- ``POST /chat``: respuesta completa en JSON.
+- ``POST /chat/stream``: respuesta en streaming como Server-Sent Events. Cada
+  evento ``data`` trae ``{"delta": "..."}``; al final llega un evento ``done``
+  con el modelo usado, o ``error`` si algo falla a mitad de la respuesta.
+- ``GET /metrics``: tiempos por etapa de cada turno en formato Prometheus
+  (ver ``sofia.telemetry``).
+
+Las preguntas claramente fuera del SOP reciben la negativa fija sin llamar al
+modelo (``"filtered": true``, ver ``sofia.topic_filter``).
+
+Con ``"model": "auto"`` cada pregunta va al modelo grande o al pequeño según
+su dificultad (``sofia.router``). En ``/chat`` la respuesta del pequeño que no
+pasa las comprobaciones se vuelve a pedir al grande.
+
+El cuerpo de ambas peticiones es::
+
+    {"messages": [{"role": "user", "content": "¿Qué es el SOP?"}],
+     "model": "llama-3.3-70b-versatile", "temperature": 0.6, "max_tokens": 2048}
+
+El historial lo manda quien llama y solo puede tener mensajes ``user`` y
+``assistant``: nada de lo que envía llega al modelo como mensaje de sistema.
+Los mensajes más antiguos que no caben en el presupuesto de tokens se dejan
+fuera.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Literal
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from groq import APIError, AsyncGroq, RateLimitError
+from pydantic import BaseModel, Field
+
+from sofia.groq_client import AsyncRateLimitedClient
+from sofia.pipeline import MAX_TOKENS, MODEL, PDF_PATH, TEMPERATURE, ChatPipeline
+from sofia.prompts import OFF_TOPIC_REPLY
+from sofia.router import AUTO_MODEL, ModelRouter
+from sofia.single_flight import AsyncCoalescingClient
+from sofia.telemetry import TELEMETRY, configure_logging, stage
+from sofia.tokens import count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+# También con "uvicorn sofia.api:app", que no configura el logging de la aplicación
+configure_logging()
+
+
+class Message(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+
+class ChatRequest(BaseModel):
+    messages: List[Message] = Field(min_length=1)
+    model: str = MODEL
+    temperature: float = Field(TEMPERATURE, ge=0, le=2)
+    max_tokens: int = Field(MAX_TOKENS, ge=1, le=8192)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    load_dotenv()
+    pdf_path = os.getenv("SOFIA_PDF_PATH", PDF_PATH)
+    # La primera carga puede extraer el PDF: fuera del event loop
+    app.state.pipeline = await asyncio.to_thread(ChatPipeline, pdf_path)
+    groq = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0)
+    app.state.client = AsyncCoalescingClient(
+        AsyncRateLimitedClient(groq, fallback=os.getenv("SOFIA_MODEL_FALLBACK", "1") != "0")
+    )
+    app.state.router = ModelRouter()
+    logger.info("Guía cargada: %d chunks", len(app.state.pipeline.chunks))
+    yield
+    await groq.close()
+
+
+app = FastAPI(title="Sofía - Guía Educativa SOP", lifespan=lifespan)
+
+
+def _history(body):
+    history = [message.model_dump() for message in body.messages]
+    if history[-1]["role"] != "user":
+        raise HTTPException(status_code=422, detail="El último mensaje debe ser de la usuaria")
+    return history
+
+
+def _off_topic(request, history, turn):
+    """Preguntas claramente fuera del SOP: se rechazan sin llamar al modelo"""
+    with turn.stage("topic_filter"):
+        follow_up = sum(message["role"] == "user" for message in history) > 1
+        return not request.app.state.pipeline.is_on_topic(history[-1]["content"], follow_up)
+
+
+def _model(request, body, history, turn=None):
+    """Modelo pedido o, con ``"auto"``, el que elige el router para la última pregunta.
+
+    Devuelve ``(modelo, chunks)``; los chunks que buscó el router se reutilizan
+    al armar los mensajes (``None`` sin router).
+    """
+    if body.model != AUTO_MODEL:
+        return body.model, None
+    question = history[-1]["content"]
+    history_turns = sum(message["role"] == "user" for message in history) - 1
+    with stage(turn, "retrieve"):
+        chunks = request.app.state.pipeline.retrieve(question)
+    with stage(turn, "route"):
+        model, _ = request.app.state.router.route(question, chunks, history_turns)
+    return model, chunks
+
+
+def _completion_request(request, body, history, turn=None):
+    model, chunks = _model(request, body, history, turn)
+    messages = request.app.state.pipeline.build_messages(history, model, turn=turn, chunks=chunks)
+    return {
+        "model": model,
+        "messages": messages,
+        "temperature": body.temperature,
+        "max_tokens": body.max_tokens,
+    }
+
+
+async def _create(request, **completion_request):
+    try:
+        return await request.app.state.client.create(**completion_request)
+    except RateLimitError:
+        raise HTTPException(status_code=429, detail="Límite de uso de la API alcanzado, intenta más tarde")
+    except APIError as e:
+        logger.exception("Error de Groq")
+        raise HTTPException(status_code=502, detail=f"Error del proveedor: {str(e)[:200]}")
+
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/health")
+async def health(request: Request):
+    return {"status": "ok", "chunks": len(request.app.state.pipeline.chunks)}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(TELEMETRY.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/chat")
+async def chat(request: Request, body: ChatRequest):
+    history = _history(body)
+    turn = TELEMETRY.turn(source="api")
+    if _off_topic(request, history, turn):
+        turn.finish(outcome="filtered")
+        return {"answer": OFF_TOPIC_REPLY, "model": None, "filtered": True}
+    completion_request = _completion_request(request, body, history, turn)
+    try:
+        with turn.stage("generate"):
+            completion = await _create(request, **completion_request)
+            router = request.app.state.router
+            if body.model == AUTO_MODEL and router.should_retry(completion_request["model"],
+                                                                completion.choices[0].message.content,
+                                                                completion.model):
+                completion = await _create(request, **{**completion_request, "model": router.large})
+    except HTTPException:
+        turn.finish(outcome="error", model=completion_request["model"])
+        raise
+    usage = getattr(completion, "usage", None)
+    turn.finish(
+        outcome="answered",
+        model=completion.model,
+        prompt_tokens=getattr(usage, "prompt_tokens", None)
+        or count_message_tokens(completion_request["messages"], completion.model),
+        completion_tokens=getattr(usage, "completion_tokens", None)
+        or count_tokens(completion.choices[0].message.content, completion.model),
+    )
+    return {"answer": completion.choices[0].message.content, "model": completion.model, "filtered": False}
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request, body: ChatRequest):
+    history = _history(body)
+    turn = TELEMETRY.turn(source="api_stream")
+    if _off_topic(request, history, turn):
+        turn.finish(outcome="filtered")
+
+        async def refusal():
+            yield _sse({"delta": OFF_TOPIC_REPLY})
+            yield _sse({"model": None, "filtered": True}, event="done")
+
+        return StreamingResponse(refusal(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    # Los errores antes del primer token se devuelven como código HTTP
+    completion_request = _completion_request(request, body, history, turn)
+    start = time.perf_counter()
+    try:
+        with turn.stage("request"):
+            stream = await _create(request, stream=True, **completion_request)
+    except HTTPException:
+        turn.finish(outcome="error", model=completion_request["model"])
+        raise
+
+    async def events():
+        model = completion_request["model"]
+        answer = ""
+        outcome = "answered"
+        try:
+            async for chunk in stream:
+                model = chunk.model or model
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not answer:
+                        turn.add("ttft", time.perf_counter() - start)
+                    answer += chunk.choices[0].delta.content
+                    yield _sse({"delta": chunk.choices[0].delta.content})
+            yield _sse({"model": model, "filtered": False}, event="done")
+        except Exception as e:
+            outcome = "error"
+            logger.exception("Error durante el streaming")
+            yield _sse({"error": str(e)[:200]}, event="error")
+        finally:
+            turn.add("generate", time.perf_counter() - start)
+            turn.finish(
+                outcome=outcome,
+                model=model,
+                prompt_tokens=count_message_tokens(completion_request["messages"], model),
+                completion_tokens=count_tokens(answer, model),
+            )
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="API HTTP de Sofía")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    uvicorn.run("sofia.api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""Benchmarks sin conexión del flujo de Sofía, con Groq simulado.
+
+Uso::
+
+    python -m sofia.benchmark                     # compara con la línea base guardada
+    python -m sofia.benchmark --save-baseline     # guarda los resultados como línea base
+    python -m sofia.benchmark --only micro --repeat 50
+
+Hay dos grupos:
+
+- ``micro``: carga del PDF desde la caché, chunking, carga de la guía
+  completa (``ChatPipeline``), búsqueda, ``create_prompt`` y armado de los
+  mensajes sobre ``guia_sop.pdf``. Con ``--cold`` también la extracción del
+  texto del PDF sin caché (tarda decenas de segundos).
+- ``e2e``: turnos completos (mensajes + respuesta en streaming por
+  ``RateLimitedClient``) contra ``sofia.mock_groq``, con y sin 429.
+
+Los tiempos se comparan con la línea base (``BASELINE_PATH``); una métrica
+empeora si sube más de ``TOLERANCE`` y más de ``MIN_DELTA_MS``. Con alguna
+regresión el comando termina con código 1. La línea base depende de la
+máquina: guárdala en la misma donde se compara.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+from groq import Groq
+
+from sofia.chunking import CHUNK_MAX_TOKENS, CHUNK_OVERLAP, CHUNK_SIZE, chunk_pages
+from sofia.groq_client import RATE_LIMITS, Metrics, RateLimitedClient, RateLimiter
+from sofia.mock_groq import MockGroqServer
+from sofia.normalize import normalize_chunks
+from sofia.pdf_loader import CACHE_DIR, extract_pages, load_pages
+from sofia.pipeline import MAX_TOKENS, MODEL, PDF_PATH, TEMPERATURE, ChatPipeline
+from sofia.prompts import create_prompt
+from sofia.streaming import NullPlaceholder, stream_completion
+from sofia.topics import TOPICS
+
+BASELINE_PATH = os.getenv("SOFIA_BENCH_BASELINE", os.path.join(CACHE_DIR, "benchmarks", "baseline.json"))
+TOLERANCE = 0.25  # Fracción que puede subir una métrica antes de contar como regresión
+MIN_DELTA_MS = 0.5  # Diferencias menores no cuentan (ruido de las medidas muy cortas)
+
+# Preguntas escritas además de los temas guiados
+QUESTIONS = list(TOPICS.values()) + [
+    "¿La metformina ayuda a bajar de peso si tengo SOP?",
+    "tengo la regla muy irregular y mucho acné, ¿qué hago?",
+    "¿Puedo quedar embarazada con ovarios poliquísticos?",
+    "¿qué ejercicio es mejor para la resistencia a la insulina?",
+    "¿El inositol sirve?",
+]
+# Sin límites locales: se mide el flujo, no la cuota
+UNLIMITED = {model: {"rpm": 10 ** 9, "tpm": 10 ** 12} for model in RATE_LIMITS}
+
+
+def _timings(function, repeat):
+    """Milisegundos de cada una de ``repeat`` llamadas a ``function()``"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def _stats(times):
+    ordered = sorted(times)
+    return {
+        "p50_ms": round(statistics.median(ordered), 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 4),
+        "n": len(ordered),
+    }
+
+
+def _per_question(function, repeat):
+    """Tiempos de ``function(pregunta)`` para todas las preguntas, ``repeat`` veces"""
+    times = []
+    for _ in range(repeat):
+        for question in QUESTIONS:
+            times += _timings(lambda: function(question), 1)
+    return times
+
+
+def run_micro(pdf_path, repeat, cold=False):
+    """Benchmarks de las etapas locales sobre la guía"""
+    results = {}
+    slow_repeat = max(1, repeat // 10)
+    if cold:
+        results["pdf_extract"] = _stats(_timings(lambda: extract_pages(pdf_path), 1))
+
+    # La primera vez extrae el PDF y llena la caché de la app
+    pages = load_pages(pdf_path)
+    results["pdf_load_cached"] = _stats(_timings(lambda: load_pages(pdf_path), repeat))
+    results["chunk"] = _stats(_timings(
+        lambda: normalize_chunks(chunk_pages(pages, CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_MAX_TOKENS)), slow_repeat
+    ))
+
+    results["pipeline_load"] = _stats(_timings(lambda: ChatPipeline(pdf_path), slow_repeat))
+    pipeline = ChatPipeline(pdf_path)
+    results["retrieve"] = _stats(_per_question(pipeline.retrieve, repeat))
+    context = "\n\n".join(chunk["text"] for chunk in pipeline.chunks[:6])
+    results["create_prompt"] = _stats(_timings(lambda: create_prompt(context), repeat * 10))
+    results["build_messages"] = _stats(_per_question(
+        lambda question: pipeline.build_messages([{"role": "user", "content": question}], MODEL), repeat
+    ))
+    return results
+
+
+def _run_turns(pipeline, server, model, turns):
+    client = RateLimitedClient(
+        Groq(api_key="mock", base_url=server.url, max_retries=0),
+        limiter=RateLimiter(UNLIMITED), metrics=Metrics(), fallback=False, base_delay=0.05,
+    )
+    ttft, total = [], []
+    start = time.perf_counter()
+    for index in range(turns):
+        question = QUESTIONS[index % len(QUESTIONS)]
+        turn_start = time.perf_counter()
+        messages = pipeline.build_messages([{"role": "user", "content": question}], model)
+        prepared = time.perf_counter() - turn_start
+        _, stats = stream_completion(client, NullPlaceholder(), model=model, messages=messages,
+                                     temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+        if stats["ttft"] is not None:
+            ttft.append((prepared + stats["ttft"]) * 1000)
+        total.append((time.perf_counter() - turn_start) * 1000)
+    elapsed = time.perf_counter() - start
+    counters = client.metrics.snapshot()
+    return {
+        "ttft": _stats(ttft),
+        "turn": _stats(total),
+        "turns_per_s": round(turns / elapsed, 3),
+        "tokens_per_s": round(server.stats["completion_tokens"] / elapsed, 1),
+        "retries": counters.get("retries", 0),
+    }
+
+
+def run_e2e(pdf_path, turns, tokens_per_second, first_token_delay):
+    """Turnos completos contra el servidor simulado, sin 429 y con un 429 cada 5 peticiones"""
+    pipeline = ChatPipeline(pdf_path)
+    results = {}
+    for name, rate_limit_every in (("e2e", 0), ("e2e_429", 5)):
+        with MockGroqServer(tokens_per_second=tokens_per_second, first_token_delay=first_token_delay,
+                            rate_limit_every=rate_limit_every, retry_after=0.1, seed=1) as server:
+            results[name] = _run_turns(pipeline, server, MODEL, turns)
+    return results
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def compare(results, baseline, tolerance=TOLERANCE, min_delta=MIN_DELTA_MS):
+    """Filas ``(métrica, base, actual, cambio, regresión)`` de los tiempos comparables"""
+    rows = []
+    current = _flatten(results)
+    for metric, base in _flatten(baseline).items():
+        if not metric.endswith("_ms") or metric not in current or not base:
+            continue
+        value = current[metric]
+        change = (value - base) / base
+        rows.append((metric, base, value, change, change > tolerance and value - base > min_delta))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pdf", default=PDF_PATH, help="ruta de la guía PDF")
+    parser.add_argument("--only", choices=["micro", "e2e"], help="correr solo un grupo")
+    parser.add_argument("--repeat", type=int, default=20, help="repeticiones de los micro-benchmarks")
+    parser.add_argument("--cold", action="store_true", help="medir también la extracción del PDF sin caché")
+    parser.add_argument("--turns", type=int, default=20, help="turnos de los benchmarks e2e")
+    parser.add_argument("--tokens-per-second", type=float, default=1000.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.05, help="segundos")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="guardar los resultados como línea base")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    results = {}
+    if args.only in (None, "micro"):
+        results["micro"] = run_micro(args.pdf, args.repeat, args.cold)
+    if args.only in (None, "e2e"):
+        results["e2e"] = run_e2e(args.pdf, args.turns, args.tokens_per_second, args.first_token_delay)
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Línea base guardada en {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Sin línea base en {args.baseline} (usa --save-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+    regressions = 0
+    for metric, base, value, change, regression in compare(results, baseline, args.tolerance):
+        regressions += regression
+        print(f"{'REGRESIÓN' if regression else 'ok':<10} {metric:<32} {base:>10.3f} → {value:>10.3f} ms ({change:+.0%})")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""División de la guía en chunks que respetan títulos, párrafos y oraciones.
+
+Cada chunk es un diccionario ``{"text", "page_start", "page_end"}`` con las
+páginas (desde 1) de las que sale su texto. Los chunks nunca cortan una
+oración a la mitad salvo que la oración sola supere el tamaño máximo. Los
+chunks de la bibliografía (``is_reference_list``) se descartan: no responden
+preguntas y, con tantos términos médicos, salían entre los primeros.
+"""
+import re
+from collections import Counter
+
+from sofia.normalize import repair_hyphenation
+from sofia.tokens import estimate_tokens
+
+# Versión del algoritmo, forma parte de la clave de la caché de chunks
+CHUNKER_VERSION = 4
+
+# Valores por defecto (los mismos que usa bot3.0.py)
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+CHUNK_MAX_TOKENS = 350
+
+# Títulos numerados ("4.4 Metformin ...") y recomendaciones ("4.4.1 EBR ...")
+_NUMBERED_RE = re.compile(r"^\d+(\.\d+)*\.?\s+\S")
+_HEADING_RE = re.compile(r"^\d+(\.\d+)?\.?\s+[^.]{3,100}$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"“¿¡(]?[A-ZÁÉÍÓÚÑ0-9])")
+_SPACES_RE = re.compile(r"\s+")
+# Citas bibliográficas: "et al" o un año seguido de punto y coma ("2019;12:34")
+_CITATION_RE = re.compile(r"\b(?:19|20)\d\d\s*;|\bet al\b")
+REFERENCE_MIN_CITATIONS = 3  # En el texto de la guía ningún chunk tiene más de 2
+
+
+def chunker_key(size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, max_tokens=CHUNK_MAX_TOKENS):
+    """Clave que identifica los parámetros del chunker en la caché"""
+    return f"structured-v{CHUNKER_VERSION}-{size}-{overlap}-{max_tokens}"
+
+
+def _running_header(pages):
+    """Detecta la línea de encabezado que se repite en la mayoría de las páginas"""
+    first_lines = Counter()
+    for text in pages:
+        line = text.strip().split("\n", 1)[0]
+        first_lines[re.sub(r"\d+", "", _SPACES_RE.sub(" ", line)).strip()] += 1
+    if not first_lines:
+        return None
+    header, count = first_lines.most_common(1)[0]
+    return header if header and count > len(pages) / 2 else None
+
+
+def _blocks(pages):
+    """Agrupa las líneas de cada página en bloques (título o párrafo).
+
+    Devuelve tuplas ``(texto, página, es_titulo)``.
+    """
+    header = _running_header(pages)
+    for page_num, text in enumerate(pages, start=1):
+        lines = []
+        # Antes de unir las líneas: después ya no se distingue "diag-\nnóstico" de "HOMA- IR"
+        for line in repair_hyphenation(text).split("\n"):
+            line = _SPACES_RE.sub(" ", line).strip()
+            if header and re.sub(r"\d+", "", line).strip() == header:
+                continue
+            if not line or _NUMBERED_RE.match(line):
+                if lines:
+                    yield " ".join(lines), page_num, False
+                    lines = []
+                if line and _HEADING_RE.match(line):
+                    yield line, page_num, True
+                    continue
+            if line:
+                lines.append(line)
+        if lines:
+            yield " ".join(lines), page_num, False
+
+
+def is_reference_list(text):
+    """``True`` si el texto parece parte de la lista de referencias bibliográficas"""
+    return len(_CITATION_RE.findall(text)) >= REFERENCE_MIN_CITATIONS
+
+
+def _split_long(sentence, size):
+    """Corta por palabras una oración más larga que ``size`` caracteres"""
+    words = sentence.split(" ")
+    piece = []
+    length = 0
+    for word in words:
+        if piece and length + len(word) + 1 > size:
+            yield " ".join(piece)
+            piece = []
+            length = 0
+        piece.append(word)
+        length += len(word) + 1
+    if piece:
+        yield " ".join(piece)
+
+
+def chunk_pages(pages, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP, max_tokens=CHUNK_MAX_TOKENS):
+    """Divide las páginas en chunks de como máximo ``size`` caracteres y ``max_tokens`` tokens.
+
+    Los títulos abren un chunk nuevo y, cuando un chunk se corta por tamaño, el
+    siguiente repite las últimas oraciones (hasta ``overlap`` caracteres) para no
+    perder el contexto.
+    """
+    chunks = []
+    current = []  # (oración, página, tokens)
+
+    def length_of(units):
+        return sum(len(text) + 1 for text, _, _ in units)
+
+    def tokens_of(units):
+        return sum(tokens for _, _, tokens in units)
+
+    def flush(keep_overlap):
+        nonlocal current
+        if not current:
+            return
+        text = " ".join(text for text, _, _ in current)
+        if not is_reference_list(text):
+            chunks.append({
+                "text": text,
+                "page_start": min(page for _, page, _ in current),
+                "page_end": max(page for _, page, _ in current),
+            })
+        carried = []
+        if keep_overlap:
+            for unit in reversed(current[1:]):
+                if length_of(carried) + len(unit[0]) > overlap:
+                    break
+                carried.insert(0, unit)
+        current = carried
+
+    for text, page, is_heading in _blocks(pages):
+        if is_heading:
+            # Un título abre un chunk nuevo si el actual ya tiene contenido suficiente
+            if length_of(current) > size // 3:
+                flush(keep_overlap=False)
+            current.append((text, page, estimate_tokens(text)))
+            continue
+
+        for sentence in _SENTENCE_RE.split(text):
+            for piece in _split_long(sentence, size):
+                tokens = estimate_tokens(piece)
+                if current and (length_of(current) + len(piece) > size
+                                or tokens_of(current) + tokens > max_tokens):
+                    flush(keep_overlap=True)
+                    # El solapamiento no puede hacer que el chunk nuevo pase del máximo
+                    while current and (length_of(current) + len(piece) > size
+                                       or tokens_of(current) + tokens > max_tokens):
+                        current.pop(0)
+                current.append((piece, page, tokens))
+
+    flush(keep_overlap=False)
+    return chunks
+
+
+def split_sentences(text):
+    """Divide un texto en oraciones (el mismo criterio que usa ``chunk_pages``)"""
+    return [sentence for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+
+def chunk_text(chunk):
+    """Texto de un chunk, sea un diccionario de ``chunk_pages`` o una cadena"""
+    return chunk["text"] if isinstance(chunk, dict) else chunk
+
+
+def format_context(chunks):
+    """Une los chunks en un solo contexto indicando las páginas de la guía"""
+    parts = []
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            if chunk["page_start"] == chunk["page_end"]:
+                pages = f"página {chunk['page_start']}"
+            else:
+                pages = f"páginas {chunk['page_start']}-{chunk['page_end']}"
+            parts.append(f"[Guía, {pages}]\n{chunk['text']}")
+        else:
+            parts.append(chunk)
+    return "\n\n".join(parts)
@@ -0,0 +1,93 @@
+"""Compresión extractiva del contexto antes de armar el prompt.
+
+De cada chunk recuperado solo unas pocas oraciones responden la pregunta.
+``ContextCompressor`` puntúa cada oración de los chunks contra los términos de
+la pregunta (suma del IDF de los términos que comparte, normalizada por su
+largo), se queda con las mejores hasta ``budget`` tokens y las devuelve en su
+orden original dentro de cada chunk. Todo es local: no hay llamadas a la API.
+"""
+import math
+from collections import Counter
+
+from sofia.chunking import chunk_text, split_sentences
+from sofia.normalize import analyze
+from sofia.tokens import estimate_tokens
+
+# Tokens de la guía que se conservan por pregunta
+COMPRESSED_CONTEXT_TOKENS = 600
+# Entre oraciones no contiguas del mismo chunk
+GAP = " […] "
+
+
+class ContextCompressor:
+    """Selecciona las oraciones de los chunks que mejor responden a una pregunta.
+
+    ``documents_terms`` son los términos de todos los chunks de la guía y
+    sirven para calcular el IDF de cada término.
+    """
+
+    def __init__(self, documents_terms, budget=COMPRESSED_CONTEXT_TOKENS):
+        doc_freq = Counter()
+        num_docs = 0
+        for terms in documents_terms:
+            doc_freq.update(set(terms))
+            num_docs += 1
+        self.idf = {term: math.log(1 + num_docs / freq) for term, freq in doc_freq.items()}
+        self.default_idf = math.log(1 + num_docs) if num_docs else 1.0
+        self.budget = budget
+        self._sentences = {}
+
+    def _split(self, text):
+        """Oraciones del chunk con sus términos y tokens (se calculan una vez por chunk)"""
+        if text not in self._sentences:
+            self._sentences[text] = [
+                (sentence, set(analyze(sentence)), estimate_tokens(sentence))
+                for sentence in split_sentences(text)
+            ]
+        return self._sentences[text]
+
+    def compress(self, query_terms, chunks, budget=None):
+        """Devuelve los chunks reducidos a sus mejores oraciones, en el mismo orden.
+
+        Los chunks sin ninguna oración elegida se omiten. Si ninguna oración
+        comparte términos con la pregunta, los chunks se devuelven tal cual.
+        """
+        budget = self.budget if budget is None else budget
+        query = set(query_terms)
+
+        candidates = []  # (puntuación, chunk, oración)
+        for chunk_id, chunk in enumerate(chunks):
+            for sentence_id, (_, terms, tokens) in enumerate(self._split(chunk_text(chunk))):
+                shared = query & terms
+                if shared:
+                    score = sum(self.idf.get(term, self.default_idf) for term in shared) / math.sqrt(max(tokens, 8))
+                    candidates.append((score, chunk_id, sentence_id))
+        if not candidates:
+            return chunks
+
+        kept = set()
+        seen = set()  # Los chunks contiguos comparten oraciones (solapamiento)
+        used = 0
+        for _, chunk_id, sentence_id in sorted(candidates, key=lambda item: item[0], reverse=True):
+            sentence, _, tokens = self._split(chunk_text(chunks[chunk_id]))[sentence_id]
+            if sentence in seen or used + tokens > budget:
+                continue
+            kept.add((chunk_id, sentence_id))
+            seen.add(sentence)
+            used += tokens
+
+        compressed = []
+        for chunk_id, chunk in enumerate(chunks):
+            sentences = self._split(chunk_text(chunk))
+            text = ""
+            previous = None
+            for sentence_id, (sentence, _, _) in enumerate(sentences):
+                if (chunk_id, sentence_id) not in kept:
+                    continue
+                if text:
+                    text += " " if previous == sentence_id - 1 else GAP
+                text += sentence
+                previous = sentence_id
+            if text:
+                compressed.append({**chunk, "text": text} if isinstance(chunk, dict) else text)
+        return compressed
@@ -0,0 +1,76 @@
+"""Armado de los mensajes que se envían al modelo dentro de un presupuesto de tokens.
+
+El presupuesto se reparte por prioridad:
+
+1. Las reglas del prompt de sistema y la última pregunta del usuario (siempre).
+2. Los chunks de la guía, en el orden de relevancia en que llegan.
+3. El resumen de los turnos viejos, si lo hay (ver ``sofia.history``).
+4. Los turnos anteriores de la conversación, del más reciente al más antiguo.
+"""
+from sofia.chunking import format_context
+from sofia.tokens import TOKENS_PER_MESSAGE, context_window, count_tokens
+
+# Por debajo de este margen ya no se intenta meter más chunks
+MIN_CHUNK_TOKENS = 32
+
+SUMMARY_HEADER = "📝 RESUMEN DE LA CONVERSACIÓN HASTA AHORA:\n"
+
+
+def build_messages(create_prompt, chunks, history, model, budget, max_tokens=0,
+                   context_budget=None, max_history=10, join=format_context, summary=""):
+    """Devuelve la lista de mensajes para ``chat.completions.create``.
+
+    ``create_prompt(contexto)`` arma el prompt de sistema con el texto de la
+    guía; ``chunks`` son los fragmentos de la guía de más a menos relevante y
+    ``history`` los mensajes de la conversación (el último es la pregunta
+    actual). ``budget`` es el máximo de tokens de entrada, que además nunca pasa
+    de la ventana del modelo menos los ``max_tokens`` de la respuesta.
+    ``context_budget`` limita los tokens dedicados a la guía y ``join`` une los
+    chunks elegidos en un solo texto. ``summary`` es el resumen de los mensajes
+    anteriores a ``history``.
+    """
+    budget = min(budget, context_window(model) - max_tokens)
+    turns = [msg for msg in history if msg["role"] != "system"][-max_history:]
+    required = turns[-1:]
+    earlier = turns[:-1]
+
+    used = count_tokens(create_prompt(""), model) + TOKENS_PER_MESSAGE
+    used += sum(count_tokens(msg["content"], model) + TOKENS_PER_MESSAGE for msg in required)
+
+    # Chunks de la guía por orden de relevancia
+    context_limit = budget if context_budget is None else min(budget, used + context_budget)
+    selected = []
+    for chunk in chunks:
+        if context_limit - used < MIN_CHUNK_TOKENS:
+            break
+        cost = count_tokens(join([chunk]), model) + 2  # separador entre chunks
+        if used + cost <= context_limit:
+            selected.append(chunk)
+            used += cost
+
+    # Resumen de la parte vieja de la conversación
+    summary_message = None
+    if summary:
+        summary_message = {"role": "system", "content": SUMMARY_HEADER + summary}
+        cost = count_tokens(summary_message["content"], model) + TOKENS_PER_MESSAGE
+        if used + cost <= budget:
+            used += cost
+        else:
+            summary_message = None
+
+    # Turnos anteriores, del más reciente al más antiguo
+    kept = []
+    for msg in reversed(earlier):
+        cost = count_tokens(msg["content"], model) + TOKENS_PER_MESSAGE
+        if used + cost > budget:
+            break
+        kept.insert(0, msg)
+        used += cost
+
+    system_prompt = create_prompt(join(selected) if selected else "")
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary_message:
+        messages.append(summary_message)
+    for msg in kept + required:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    return messages
@@ -0,0 +1,93 @@
+"""Diversidad de los chunks recuperados: MMR y descarte de casi duplicados.
+
+La guía repite sus recomendaciones en el resumen y en las secciones de
+detalle, así que los mejores resultados de la búsqueda suelen decir lo mismo.
+Cada chunk se resume en una firma MinHash de sus shingles (grupos de
+``SHINGLE_SIZE`` términos seguidos) que estima la similitud de Jaccard entre
+dos chunks comparando ``NUM_PERM`` números. Las firmas se calculan una vez al
+cargar la guía.
+
+``select_diverse`` reordena los candidatos con maximal marginal relevance
+(relevancia menos parecido a lo ya elegido) y descarta los que son casi
+copia de un chunk ya elegido.
+"""
+import zlib
+
+import numpy as np
+
+SHINGLE_SIZE = 3
+NUM_PERM = 64
+MMR_LAMBDA = 0.7  # 1 = solo relevancia, 0 = solo diversidad
+DUPLICATE_THRESHOLD = 0.5  # Jaccard estimado a partir del cual un chunk es casi duplicado
+
+_MAX_HASH = (1 << 32) - 1
+# Permutaciones por multiplicación y desplazamiento: (a·x + b mod 2**64) >> 32
+_rng = np.random.RandomState(1)
+_A = _rng.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+_B = _rng.randint(0, 1 << 62, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+def shingles(terms, size=SHINGLE_SIZE):
+    """Hashes (CRC32) de los grupos de ``size`` términos seguidos"""
+    if len(terms) < size:
+        return {zlib.crc32(" ".join(terms).encode("utf-8"))} if terms else set()
+    return {zlib.crc32(" ".join(terms[i:i + size]).encode("utf-8")) for i in range(len(terms) - size + 1)}
+
+
+def _permute(hashes):
+    """Aplica las ``NUM_PERM`` permutaciones a cada hash (una fila por hash)"""
+    with np.errstate(over="ignore"):
+        return (hashes[:, None] * _A + _B) >> np.uint64(32)
+
+
+def minhash(terms, size=SHINGLE_SIZE):
+    """Firma MinHash (``NUM_PERM`` enteros) de los shingles de ``size`` términos de una lista"""
+    hashes = np.fromiter(shingles(terms, size), dtype=np.uint64)
+    if not len(hashes):
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    return _permute(hashes).min(axis=0).astype(np.uint32)
+
+
+def minhash_signatures(documents_terms):
+    """Matriz documentos × ``NUM_PERM`` con la firma de cada documento"""
+    doc_shingles = [shingles(terms) for terms in documents_terms]
+    signatures = np.full((len(doc_shingles), NUM_PERM), _MAX_HASH, dtype=np.uint32)
+    sizes = np.array([len(hashes) for hashes in doc_shingles], dtype=np.int64)
+    if not sizes.sum():
+        return signatures
+    hashes = np.fromiter((h for doc in doc_shingles for h in doc), dtype=np.uint64, count=int(sizes.sum()))
+    # Mínimo por documento de todas las filas a la vez
+    starts = np.cumsum(sizes) - sizes
+    non_empty = sizes > 0
+    signatures[non_empty] = np.minimum.reduceat(_permute(hashes), starts[non_empty], axis=0)
+    return signatures
+
+
+def similarity(signatures):
+    """Jaccard estimado entre cada par de firmas"""
+    return (signatures[:, None, :] == signatures[None, :, :]).mean(axis=2)
+
+
+def select_diverse(results, signatures, top_k, mmr_lambda=MMR_LAMBDA, threshold=DUPLICATE_THRESHOLD):
+    """Elige hasta ``top_k`` de ``results`` (pares puntuación, id) con MMR, sin casi duplicados"""
+    if not results:
+        return []
+    scores = np.array([score for score, _ in results], dtype=np.float64)
+    relevance = scores / scores.max() if scores.max() > 0 else scores
+    similar = similarity(signatures[[doc_id for _, doc_id in results]])
+
+    selected = []
+    remaining = list(range(len(results)))
+    while remaining and len(selected) < top_k:
+        if selected:
+            redundancy = similar[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        # Los casi duplicados de algo ya elegido no aportan nada nuevo
+        keep = redundancy < threshold
+        remaining = [candidate for candidate, ok in zip(remaining, keep) if ok]
+        if not remaining:
+            break
+        mmr = mmr_lambda * relevance[remaining] - (1 - mmr_lambda) * redundancy[keep]
+        selected.append(remaining.pop(int(np.argmax(mmr))))
+    return [results[i] for i in selected]
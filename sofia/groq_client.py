@@ -0,0 +1,409 @@
+"""Cliente de Groq que respeta los límites de uso de la API.
+
+``RateLimitedClient`` envuelve un cliente ``Groq`` y expone la misma interfaz
+``client.chat.completions.create(...)``. Antes de cada petición reserva
+capacidad en un token bucket compartido por todo el proceso (peticiones y
+tokens por minuto de cada modelo); si Groq responde 429 espera lo que indique
+``retry-after`` (o un backoff exponencial con jitter) y, si se permite, pasa al
+modelo de respaldo. Todo queda contado en ``METRICS``.
+
+La reserva de tokens cuenta el prompt más ``max_tokens``; cuando Groq informa
+el uso real (``usage``, o ``x_groq.usage`` en el último fragmento del stream)
+se devuelve al limitador lo que sobró. La respuesta dice qué modelo respondió
+(``completion.model`` / ``chunk.model``): si es el de respaldo, no es el
+pedido.
+
+Los límites por defecto son los del plan gratuito; ``SOFIA_RATE_LIMITS``
+acepta un JSON con los de otro plan, por ejemplo
+``{"llama-3.3-70b-versatile": {"rpm": 1000, "tpm": 300000}}``.
+
+``AsyncRateLimitedClient`` hace lo mismo para ``AsyncGroq`` (la API HTTP) y
+comparte los mismos límites.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import httpx
+from groq import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from sofia.tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Límites por modelo: peticiones y tokens por minuto (plan gratuito de Groq)
+FREE_TIER_LIMITS = {
+    "llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000},
+    "llama-3.1-70b-versatile": {"rpm": 30, "tpm": 6000},
+    "llama-3.1-8b-instant": {"rpm": 30, "tpm": 6000},
+}
+DEFAULT_RATE_LIMIT = {"rpm": 30, "tpm": 6000}
+
+
+def load_rate_limits(value=None):
+    """Límites del plan gratuito con los de ``SOFIA_RATE_LIMITS`` (JSON) encima"""
+    limits = {model: dict(limit) for model, limit in FREE_TIER_LIMITS.items()}
+    value = os.getenv("SOFIA_RATE_LIMITS") if value is None else value
+    if value:
+        try:
+            for model, limit in json.loads(value).items():
+                limits[model] = {**limits.get(model, DEFAULT_RATE_LIMIT), **limit}
+        except (ValueError, AttributeError, TypeError) as e:
+            logger.warning("SOFIA_RATE_LIMITS no es válido, se usan los límites del plan gratuito: %s", e)
+            return {model: dict(limit) for model, limit in FREE_TIER_LIMITS.items()}
+    return limits
+
+
+RATE_LIMITS = load_rate_limits()
+
+# Modelo al que se pasa cuando el principal está limitado
+FALLBACK_MODELS = {
+    "llama-3.3-70b-versatile": "llama-3.1-8b-instant",
+    "llama-3.1-70b-versatile": "llama-3.1-8b-instant",
+}
+
+
+class TokenBucket:
+    """Token bucket que se rellena a ``capacity`` unidades por minuto"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.level = float(capacity)
+        self.blocked_until = 0.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Reserva ``amount`` unidades; devuelve 0 si pudo o los segundos que faltan"""
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.level >= amount:
+                self.level -= amount
+                return 0.0
+            return (amount - self.level) / self.rate
+
+    def release(self, amount):
+        """Devuelve unidades reservadas que al final no se usaron"""
+        with self.lock:
+            self.level = min(self.capacity, self.level + amount)
+
+    def block(self, seconds):
+        """No deja pasar nada durante ``seconds`` segundos"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def available(self):
+        """Fracción de la capacidad disponible ahora (0 a 1)"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self.blocked_until:
+                return 0.0
+            return self.level / self.capacity
+
+
+class RateLimiter:
+    """Buckets de peticiones y tokens por minuto para cada modelo"""
+
+    def __init__(self, limits=RATE_LIMITS):
+        self.limits = limits
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def _buckets(self, model):
+        with self.lock:
+            if model not in self.buckets:
+                limit = self.limits.get(model, DEFAULT_RATE_LIMIT)
+                self.buckets[model] = (TokenBucket(limit["rpm"]), TokenBucket(limit["tpm"]))
+            return self.buckets[model]
+
+    def acquire(self, model, tokens, max_wait):
+        """Espera hasta que haya capacidad para una petición de ``tokens`` tokens.
+
+        Devuelve los segundos esperados, o ``None`` si no hubo capacidad en
+        ``max_wait`` segundos.
+        """
+        waited = 0.0
+        while True:
+            wait = self._reserve(model, tokens)
+            if not wait:
+                return waited
+            if waited + wait > max_wait:
+                return None
+            time.sleep(wait)
+            waited += wait
+
+    async def acquire_async(self, model, tokens, max_wait):
+        """Igual que ``acquire`` pero esperando con ``asyncio.sleep``"""
+        waited = 0.0
+        while True:
+            wait = self._reserve(model, tokens)
+            if not wait:
+                return waited
+            if waited + wait > max_wait:
+                return None
+            await asyncio.sleep(wait)
+            waited += wait
+
+    def settle(self, model, reserved, used):
+        """Devuelve los tokens reservados que la petición no llegó a usar"""
+        if used is not None and used < reserved:
+            self._buckets(model)[1].release(reserved - used)
+
+    def _reserve(self, model, tokens):
+        """Reserva una petición y ``tokens`` tokens; devuelve 0 o los segundos que faltan"""
+        requests, token_bucket = self._buckets(model)
+        wait = requests.reserve(1)
+        if wait:
+            return wait
+        wait = token_bucket.reserve(tokens)
+        if wait:
+            requests.release(1)
+        return wait
+
+    def block(self, model, seconds):
+        """Pausa el modelo tras un 429 de Groq"""
+        for bucket in self._buckets(model):
+            bucket.block(seconds)
+
+    def headroom(self, model):
+        """Fracción de la capacidad por minuto que le queda al modelo (0 a 1)"""
+        return min(bucket.available() for bucket in self._buckets(model))
+
+
+class Metrics:
+    """Contadores de uso del cliente, seguros entre hilos"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+# Compartidos por todos los clientes (y sesiones) del proceso
+LIMITER = RateLimiter()
+METRICS = Metrics()
+
+
+def _local_429():
+    """Respuesta 429 sintética para los errores que genera el propio limitador"""
+    return httpx.Response(429, request=httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions"))
+
+
+def _used_tokens(response):
+    """Tokens que Groq dice haber usado en la respuesta o el fragmento, o ``None``"""
+    usage = getattr(response, "usage", None) or getattr(getattr(response, "x_groq", None), "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+
+class _MeteredStream:
+    """Stream de Groq que, al llegar el uso real, devuelve al limitador lo que sobró"""
+
+    def __init__(self, stream, settle):
+        self.stream = stream
+        self.settle = settle
+
+    def _check(self, chunk):
+        used = _used_tokens(chunk)
+        if used is not None and self.settle is not None:
+            self.settle(used)
+            self.settle = None
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self._check(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self._check(chunk)
+            yield chunk
+
+    def close(self):
+        close = getattr(self.stream, "close", None)
+        return close() if close else None
+
+
+def _retry_after(error):
+    """Segundos que pide esperar Groq en la cabecera ``retry-after``, si la manda"""
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class RateLimitedClient:
+    """Envoltorio de ``Groq`` con límites compartidos, reintentos y modelo de respaldo"""
+
+    def __init__(self, client, limiter=LIMITER, metrics=METRICS, fallback=True,
+                 max_retries=3, base_delay=1.0, max_delay=20.0, max_wait=20.0, fallback_wait=2.0):
+        self.client = client
+        self.limiter = limiter
+        self.metrics = metrics
+        self.fallback = fallback
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self.fallback_wait = fallback_wait
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _plan(self, request):
+        """Tokens a reservar y modelos a probar, en orden"""
+        model = request["model"]
+        tokens = count_message_tokens(request.get("messages", []), model) + request.get("max_tokens", 1024)
+        models = [model]
+        if self.fallback and model in FALLBACK_MODELS:
+            models.append(FALLBACK_MODELS[model])
+        return tokens, models
+
+    def _metered(self, response, model, tokens, stream):
+        """Devuelve al limitador los tokens que la respuesta no usó (en streaming, al final)"""
+        if stream:
+            return _MeteredStream(response, lambda used: self.limiter.settle(model, tokens, used))
+        self.limiter.settle(model, tokens, _used_tokens(response))
+        return response
+
+    def _rate_limited(self, error, attempt, model, has_fallback):
+        """Registra un 429 y devuelve ``(espera, dejar_el_modelo)``.
+
+        La espera nunca pasa de ``max_delay``: si Groq pide más, se deja el
+        modelo (se pasa al respaldo o se devuelve el error) en vez de bloquear
+        a la usuaria todo ese tiempo.
+        """
+        self.metrics.inc("rate_limited")
+        delay = _retry_after(error)
+        delay = delay + random.uniform(0, self.base_delay) if delay is not None else self._backoff(attempt)
+        self.limiter.block(model, delay)
+        give_up = delay > self.max_delay or (has_fallback and delay > self.base_delay * 2)
+        return min(delay, self.max_delay), give_up
+
+    def _no_capacity(self, model, max_wait):
+        self.metrics.inc("throttled")
+        return RateLimitError(
+            f"rate_limit: sin capacidad para {model} en {max_wait:g} s",
+            response=_local_429(), body=None,
+        )
+
+    def create(self, **request):
+        """Igual que ``Groq().chat.completions.create`` pero respetando los límites"""
+        model = request["model"]
+        tokens, models = self._plan(request)
+
+        last_error = None
+        for index, current in enumerate(models):
+            has_fallback = index + 1 < len(models)
+            if index:
+                self.metrics.inc("fallbacks")
+                logger.warning("Usando el modelo de respaldo %s en lugar de %s", current, model)
+
+            for attempt in range(self.max_retries + 1):
+                max_wait = self.fallback_wait if has_fallback else self.max_wait
+                waited = self.limiter.acquire(current, tokens, max_wait)
+                if waited is None:
+                    # Sin capacidad local: mejor el respaldo que hacer esperar a la usuaria
+                    error = self._no_capacity(current, max_wait)
+                    if has_fallback:
+                        break
+                    raise error
+                if waited:
+                    self.metrics.inc("throttle_waits")
+                    self.metrics.inc("throttle_wait_seconds", waited)
+
+                self.metrics.inc("requests")
+                try:
+                    response = self.client.chat.completions.create(**{**request, "model": current})
+                    return self._metered(response, current, tokens, request.get("stream"))
+                except RateLimitError as e:
+                    last_error = e
+                    delay, give_up = self._rate_limited(e, attempt, current, has_fallback)
+                    if give_up:
+                        break
+                except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    last_error = e
+                    self.metrics.inc("transient_errors")
+                    delay = self._backoff(attempt)
+
+                if attempt == self.max_retries:
+                    break
+                self.metrics.inc("retries")
+                time.sleep(delay)
+
+        self.metrics.inc("failures")
+        raise last_error
+
+
+class AsyncRateLimitedClient(RateLimitedClient):
+    """Versión para ``AsyncGroq``: comparte límites y métricas con los clientes síncronos"""
+
+    async def create(self, **request):
+        """Igual que ``AsyncGroq().chat.completions.create`` pero respetando los límites"""
+        model = request["model"]
+        tokens, models = self._plan(request)
+
+        last_error = None
+        for index, current in enumerate(models):
+            has_fallback = index + 1 < len(models)
+            if index:
+                self.metrics.inc("fallbacks")
+                logger.warning("Usando el modelo de respaldo %s en lugar de %s", current, model)
+
+            for attempt in range(self.max_retries + 1):
+                max_wait = self.fallback_wait if has_fallback else self.max_wait
+                waited = await self.limiter.acquire_async(current, tokens, max_wait)
+                if waited is None:
+                    error = self._no_capacity(current, max_wait)
+                    if has_fallback:
+                        break
+                    raise error
+                if waited:
+                    self.metrics.inc("throttle_waits")
+                    self.metrics.inc("throttle_wait_seconds", waited)
+
+                self.metrics.inc("requests")
+                try:
+                    response = await self.client.chat.completions.create(**{**request, "model": current})
+                    return self._metered(response, current, tokens, request.get("stream"))
+                except RateLimitError as e:
+                    last_error = e
+                    delay, give_up = self._rate_limited(e, attempt, current, has_fallback)
+                    if give_up:
+                        break
+                except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                    last_error = e
+                    self.metrics.inc("transient_errors")
+                    delay = self._backoff(attempt)
+
+                if attempt == self.max_retries:
+                    break
+                self.metrics.inc("retries")
+                await asyncio.sleep(delay)
+
+        self.metrics.inc("failures")
+        raise last_error
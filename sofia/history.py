@@ -0,0 +1,104 @@
+"""Compactación del historial: resumen acumulado de los turnos viejos.
+
+Los últimos turnos se envían tal cual y los anteriores se van resumiendo con
+un modelo barato en un hilo aparte, así que los tokens de entrada por pregunta
+se mantienen casi constantes aunque la conversación sea larga. Mientras el
+resumen no se ha actualizado, los mensajes que todavía no cubre se siguen
+enviando completos: nunca se pierde información.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+SUMMARY_MAX_TOKENS = 400
+
+SUMMARY_PROMPT = """Resume la conversación entre una usuaria y Sofía, una guía educativa sobre el Síndrome de Ovario Poliquístico (SOP).
+
+Conserva:
+- Lo que la usuaria contó de sí misma (síntomas, edad, situación, objetivos, emociones)
+- Las preguntas que hizo
+- Los temas que Sofía ya explicó y las recomendaciones que dio, en una línea cada uno
+
+Escribe en español, en tercera persona y en máximo 150 palabras. Responde solo con el resumen."""
+
+
+class ConversationSummary:
+    """Resumen de los mensajes viejos de una conversación.
+
+    ``covered`` es cuántos mensajes del principio de la conversación ya están
+    incluidos en ``text``.
+    """
+
+    def __init__(self, client=None, model=SUMMARY_MODEL, keep_turns=2):
+        self.client = client
+        self.model = model
+        self.keep_turns = keep_turns
+        self.text = ""
+        self.covered = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def compact(self, messages):
+        """Devuelve ``(resumen, mensajes)``: el resumen actual y los mensajes que no cubre"""
+        with self._lock:
+            if self.covered > len(messages):
+                # La conversación se reinició
+                self._clear()
+            return self.text, messages[self.covered:]
+
+    def update_async(self, messages):
+        """Resume en segundo plano los mensajes anteriores a los últimos ``keep_turns`` turnos"""
+        if self.client is None:
+            return None
+        fold_until = len(messages) - 2 * self.keep_turns
+        with self._lock:
+            if fold_until <= self.covered or (self._thread and self._thread.is_alive()):
+                return None
+            self._thread = threading.Thread(
+                target=self._update,
+                args=(self._generation, self.text, list(messages[self.covered:fold_until]), fold_until),
+                daemon=True,
+            )
+            self._thread.start()
+            return self._thread
+
+    def _update(self, generation, previous, new_messages, fold_until):
+        transcript = "\n\n".join(
+            f"{'Usuaria' if msg['role'] == 'user' else 'Sofía'}: {msg['content']}"
+            for msg in new_messages
+            if msg["role"] != "system"
+        )
+        content = f"Resumen previo:\n{previous}\n\nNuevos mensajes:\n{transcript}" if previous else transcript
+        try:
+            completion = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": content},
+                ],
+                temperature=0.2,
+                max_tokens=SUMMARY_MAX_TOKENS,
+            )
+            summary = completion.choices[0].message.content.strip()
+        except Exception as e:
+            # Sin resumen nuevo los mensajes se siguen enviando completos
+            logger.warning("No se pudo actualizar el resumen de la conversación: %s", e)
+            return
+
+        with self._lock:
+            if generation == self._generation and self.covered < fold_until:
+                self.text = summary
+                self.covered = fold_until
+
+    def _clear(self):
+        self.text = ""
+        self.covered = 0
+        self._generation += 1
+
+    def reset(self):
+        """Olvida el resumen (nueva conversación)"""
+        with self._lock:
+            self._clear()
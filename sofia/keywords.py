@@ -0,0 +1,102 @@
+"""Categorías de palabras clave y su búsqueda con un autómata Aho-Corasick.
+
+El mapa ``{categoría: [palabras o frases]}`` se lee de un archivo JSON
+(``sofia/keywords.json`` o el indicado en ``SOFIA_KEYWORDS_PATH``) y se compila
+una sola vez en un autómata sobre los términos normalizados
+(``sofia.normalize.analyze``). Una pasada por los términos de un texto
+encuentra todas las apariciones de todas las frases, con su categoría, así
+que el costo no crece con el número de palabras clave.
+"""
+import json
+import os
+from collections import deque
+
+import numpy as np
+
+from sofia.normalize import analyze
+
+KEYWORDS_PATH = os.getenv("SOFIA_KEYWORDS_PATH", os.path.join(os.path.dirname(__file__), "keywords.json"))
+
+
+def load_keywords(path=KEYWORDS_PATH):
+    """Lee el mapa de categorías del archivo JSON ``path``"""
+    with open(path, encoding="utf-8") as file:
+        keywords = json.load(file)
+    if not isinstance(keywords, dict) or not all(
+        isinstance(words, list) and all(isinstance(word, str) for word in words)
+        for words in keywords.values()
+    ):
+        raise ValueError(f"{path}: se esperaba un objeto {{categoría: [palabras]}}")
+    return keywords
+
+
+class KeywordAutomaton:
+    """Autómata Aho-Corasick cuyos símbolos son términos normalizados.
+
+    ``categories`` son los nombres de las categorías en el orden del archivo y
+    ``category_terms[i]`` los términos de todas las frases de la categoría ``i``.
+    """
+
+    def __init__(self, keywords):
+        self.categories = list(keywords)
+        self.category_terms = [[] for _ in self.categories]
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for category, words in enumerate(keywords.values()):
+            for phrase in words:
+                terms = analyze(phrase)
+                if not terms:
+                    continue
+                self.category_terms[category].extend(terms)
+                state = 0
+                for term in terms:
+                    if term not in self._goto[state]:
+                        self._goto.append({})
+                        self._fail.append(0)
+                        self._output.append([])
+                        self._goto[state][term] = len(self._goto) - 1
+                    state = self._goto[state][term]
+                if category not in self._output[state]:
+                    self._output[state].append(category)
+
+        self.category_terms = [list(dict.fromkeys(terms)) for terms in self.category_terms]
+
+        # Enlaces de fallo por niveles; cada estado hereda las salidas de su enlace
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for term, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and term not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(term, 0)
+                self._output[child] = self._output[child] + [
+                    category for category in self._output[self._fail[child]] if category not in self._output[child]
+                ]
+
+    def hits(self, terms):
+        """Genera ``(posición final, categoría)`` por cada frase encontrada en ``terms``"""
+        state = 0
+        for position, term in enumerate(terms):
+            while state and term not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(term, 0)
+            for category in self._output[state]:
+                yield position, category
+
+    def category_counts(self, terms):
+        """Número de apariciones de cada categoría en ``terms`` (una pasada)"""
+        counts = np.zeros(len(self.categories), dtype=np.int32)
+        for _, category in self.hits(terms):
+            counts[category] += 1
+        return counts
+
+    def hit_matrix(self, documents_terms):
+        """Matriz documentos × categorías con las apariciones en cada documento"""
+        rows = [self.category_counts(terms) for terms in documents_terms]
+        if not rows:
+            return np.zeros((0, len(self.categories)), dtype=np.int32)
+        return np.vstack(rows)
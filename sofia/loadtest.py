@@ -0,0 +1,251 @@
+"""Prueba de carga: N conversaciones simultáneas en un solo proceso.
+
+Simula lo que hace un worker de Streamlit con varias usuarias a la vez: cada
+sesión corre en su propio hilo (como cada rerun del script) con su historial y
+su resumen, y comparte con las demás la guía indexada, el cliente de Groq y la
+caché de respuestas. Las sesiones alternan preguntas escritas y clics en los
+temas guiados con pausas al azar, siguiendo el mismo flujo que bot3.0.py
+(filtro de tema, caché de temas, búsqueda, prompt, respuesta en streaming y
+resumen en segundo plano) contra ``sofia.mock_groq`` en otro proceso.
+
+Uso::
+
+    python -m sofia.loadtest --sessions 1,5,10,25,50 --turns 4
+    python -m sofia.loadtest --sessions 20 --limits free      # con los límites del plan gratuito
+    python -m sofia.loadtest --sessions 20 --limits config    # con los de SOFIA_RATE_LIMITS
+
+Por cada nivel de concurrencia informa:
+
+- ``turns/s``: turnos completados por segundo,
+- ``queue``: desde que se envía la pregunta hasta que Groq empieza a responder
+  (búsqueda, prompt y espera del limitador),
+- ``ttft`` y ``turn``: primer token y turno completo (p50/p95/p99),
+- ``lag``: retraso de un hilo que duerme 10 ms; si crece, el proceso (y la
+  interfaz) deja de responder a tiempo,
+- ``state``: tamaño del estado de cada sesión y memoria del proceso.
+"""
+import argparse
+import os
+import pickle
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from groq import Groq
+
+from sofia.answer_cache import AnswerCache
+from sofia.benchmark import QUESTIONS, UNLIMITED
+from sofia.groq_client import FREE_TIER_LIMITS, RATE_LIMITS, Metrics, RateLimitedClient, RateLimiter
+from sofia.history import ConversationSummary
+from sofia.pipeline import MAX_TOKENS, MODEL, PDF_PATH, TEMPERATURE, ChatPipeline
+from sofia.prompts import OFF_TOPIC_REPLY, PROMPT_VERSION
+from sofia.single_flight import CoalescingClient
+from sofia.streaming import NullPlaceholder, stream_completion
+from sofia.topics import TOPICS
+
+THINK_TIME = 2.0  # Segundos medios entre turnos de una sesión
+TOPIC_RATIO = 0.4  # Fracción de turnos que son clics en temas guiados
+LAG_INTERVAL = 0.01
+LIMITS = {"none": UNLIMITED, "free": FREE_TIER_LIMITS, "config": RATE_LIMITS}  # "config": SOFIA_RATE_LIMITS
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _rss_mb():
+    """Memoria residente del proceso (Linux), o ``None``"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return None
+
+
+class Session:
+    """Una conversación simulada con su propio estado, como ``st.session_state``"""
+
+    def __init__(self, pipeline, client, cache, rng):
+        self.pipeline = pipeline
+        self.client = client
+        self.cache = cache
+        self.rng = rng
+        self.messages = []
+        self.summary = ConversationSummary(client)
+        self.results = []  # Un diccionario por turno
+
+    def state_bytes(self):
+        return len(pickle.dumps({"messages": self.messages, "summary": self.summary.text}))
+
+    def turn(self, question, topic):
+        submitted = time.perf_counter()
+        result = {"topic": topic, "queue": None, "ttft": None}
+        self.messages.append({"role": "user", "content": question})
+        try:
+            answer = self.cache.get(question, MODEL, self.pipeline.guide_hash, PROMPT_VERSION) if topic else None
+            if answer:
+                result["outcome"] = "cached"
+            elif not topic and not self.pipeline.is_on_topic(question, follow_up=len(self.messages) > 1):
+                answer, result["outcome"] = OFF_TOPIC_REPLY, "filtered"
+            else:
+                summary, recent = self.summary.compact(self.messages)
+                messages = self.pipeline.build_messages(recent, MODEL, summary=summary)
+                prepared = time.perf_counter() - submitted
+                answer, stats = stream_completion(self.client, NullPlaceholder(), model=MODEL, messages=messages,
+                                                  temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
+                result["queue"] = prepared + stats["request"]
+                result["ttft"] = prepared + stats["ttft"] if stats["ttft"] is not None else None
+                result["outcome"] = "answered"
+                if topic and len(self.messages) == 1 and stats["model"] == MODEL:
+                    self.cache.put(question, MODEL, self.pipeline.guide_hash, PROMPT_VERSION, answer)
+        except Exception as e:
+            answer, result["outcome"] = f"Error: {e}", "error"
+        result["turn"] = time.perf_counter() - submitted
+        self.messages.append({"role": "assistant", "content": answer})
+        self.summary.update_async(self.messages)
+        self.results.append(result)
+
+    def run(self, turns, think_time, topic_ratio):
+        for _ in range(turns):
+            time.sleep(self.rng.expovariate(1 / think_time) if think_time else 0)
+            if self.rng.random() < topic_ratio:
+                self.turn(self.rng.choice(list(TOPICS.values())), topic=True)
+            else:
+                self.turn(self.rng.choice(QUESTIONS), topic=False)
+
+
+def _lag_probe(stop, lags):
+    """Mide cuánto se pasa un ``sleep`` corto: el retraso que notaría la interfaz"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        time.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - start - LAG_INTERVAL)
+
+
+def run_level(pipeline, base_url, sessions, turns, think_time=THINK_TIME, topic_ratio=TOPIC_RATIO,
+              limits="none", seed=0):
+    """Corre ``sessions`` conversaciones a la vez y devuelve las métricas del nivel"""
+    metrics = Metrics()
+    # Igual que en bot3.0.py: las peticiones idénticas en curso salen una sola vez
+    client = CoalescingClient(
+        RateLimitedClient(Groq(api_key="mock", base_url=base_url, max_retries=0),
+                          limiter=RateLimiter(LIMITS[limits]), metrics=metrics),
+        metrics=metrics,
+    )
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = AnswerCache(cache_dir=cache_dir)
+        users = [Session(pipeline, client, cache, random.Random(seed * 10007 + i)) for i in range(sessions)]
+        rss_before = _rss_mb()
+        stop = threading.Event()
+        lags = []
+        probe = threading.Thread(target=_lag_probe, args=(stop, lags), daemon=True)
+        threads = [threading.Thread(target=user.run, args=(turns, think_time, topic_ratio)) for user in users]
+
+        start = time.perf_counter()
+        probe.start()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        rss_after = _rss_mb()
+
+    results = [result for user in users for result in user.results]
+    answered = [result for result in results if result["outcome"] == "answered"]
+
+    def ms(values, q):
+        value = _percentile([v for v in values if v is not None], q)
+        return round(value * 1000, 1) if value is not None else None
+
+    return {
+        "sessions": sessions,
+        "turns": len(results),
+        "errors": sum(result["outcome"] == "error" for result in results),
+        "turns_per_s": round(len(results) / elapsed, 2),
+        "queue_p50_ms": ms([r["queue"] for r in answered], 0.5),
+        "queue_p95_ms": ms([r["queue"] for r in answered], 0.95),
+        "ttft_p95_ms": ms([r["ttft"] for r in answered], 0.95),
+        "turn_p50_ms": ms([r["turn"] for r in results], 0.5),
+        "turn_p95_ms": ms([r["turn"] for r in results], 0.95),
+        "turn_p99_ms": ms([r["turn"] for r in results], 0.99),
+        "lag_p95_ms": ms(lags, 0.95),
+        "lag_max_ms": ms(lags, 1.0),
+        "state_kb_per_session": round(sum(user.state_bytes() for user in users) / sessions / 1024, 1),
+        "rss_mb_per_session": (
+            round((rss_after - rss_before) / sessions, 2) if rss_before is not None and rss_after is not None else None
+        ),
+        "retries": metrics.snapshot().get("retries", 0),
+        "coalesced": metrics.snapshot().get("coalesced", 0),
+    }
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_server(tokens_per_second, first_token_delay, rate_limit_every):
+    """Arranca ``sofia.mock_groq`` en otro proceso (para no competir por el GIL) y devuelve ``(proceso, url)``"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "sofia.mock_groq", "--port", str(port),
+         "--tokens-per-second", str(tokens_per_second), "--first-token-delay", str(first_token_delay),
+         "--rate-limit-every", str(rate_limit_every), "--retry-after", "0.5"],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("El servidor simulado no arrancó")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pdf", default=PDF_PATH, help="ruta de la guía PDF")
+    parser.add_argument("--sessions", default="1,5,10,25", help="niveles de concurrencia, separados por comas")
+    parser.add_argument("--turns", type=int, default=4, help="turnos por sesión")
+    parser.add_argument("--think-time", type=float, default=THINK_TIME, help="segundos medios entre turnos")
+    parser.add_argument("--topic-ratio", type=float, default=TOPIC_RATIO)
+    parser.add_argument("--limits", choices=sorted(LIMITS), default="none", help="límites locales por minuto")
+    parser.add_argument("--base-url", help="servidor de chat ya arrancado (por defecto se arranca sofia.mock_groq)")
+    parser.add_argument("--tokens-per-second", type=float, default=300.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.3, help="segundos")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="429 en una de cada N peticiones")
+    args = parser.parse_args(argv)
+
+    pipeline = ChatPipeline(args.pdf)
+    process = None
+    base_url = args.base_url
+    if not base_url:
+        process, base_url = start_mock_server(args.tokens_per_second, args.first_token_delay, args.rate_limit_every)
+
+    columns = ["sessions", "turns", "errors", "turns_per_s", "queue_p50_ms", "queue_p95_ms", "ttft_p95_ms",
+               "turn_p50_ms", "turn_p95_ms", "turn_p99_ms", "lag_p95_ms", "lag_max_ms", "retries", "coalesced",
+               "state_kb_per_session", "rss_mb_per_session"]
+    print("\t".join(columns))
+    try:
+        for level in (int(value) for value in args.sessions.split(",")):
+            result = run_level(pipeline, base_url, level, args.turns, args.think_time, args.topic_ratio, args.limits)
+            print("\t".join("-" if result[column] is None else str(result[column]) for column in columns), flush=True)
+    finally:
+        if process:
+            process.terminate()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
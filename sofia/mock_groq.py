@@ -0,0 +1,217 @@
+"""Servidor local que imita ``POST /openai/v1/chat/completions`` de Groq.
+
+Sirve para medir el flujo completo (``sofia.benchmark``, pruebas de carga) sin
+gastar cuota ni depender de la red. Responde en JSON o en streaming
+(Server-Sent Events, como la API real) a la velocidad configurada y puede
+devolver 429 con ``retry-after`` cada cierto número de peticiones o con una
+probabilidad dada.
+
+Uso::
+
+    python -m sofia.mock_groq --port 8081 --tokens-per-second 300 --rate-limit-every 10
+    GROQ_BASE_URL=http://127.0.0.1:8081 streamlit run bot3.0.py
+
+El cliente de Groq lee ``GROQ_BASE_URL``, así que las apps y la API no
+necesitan cambios; cualquier ``GROQ_API_KEY`` vale.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TOKENS_PER_SECOND = 300.0
+FIRST_TOKEN_DELAY = 0.2  # Segundos hasta el primer token
+COMPLETION_TOKENS = 300  # Tokens por respuesta (o ``max_tokens`` si es menor)
+RETRY_AFTER = 1.0
+
+# Una "palabra" por token: basta para que el texto parezca una respuesta en español
+ANSWER_WORDS = (
+    "El síndrome de ovario poliquístico es una condición hormonal frecuente que puede afectar "
+    "el ciclo menstrual, la piel y el metabolismo. La guía recomienda hablar con tu médica "
+    "sobre tus síntomas, cuidar la alimentación, moverte a diario y pedir apoyo cuando lo "
+    "necesites. Cada cuerpo es distinto y hay tratamientos que ayudan."
+).split()
+
+
+def _prompt_tokens(messages):
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + 4 * len(messages)
+
+
+class MockGroqServer:
+    """Servidor en un hilo aparte; ``url`` es la base para ``Groq(base_url=...)``.
+
+    ``rate_limit_every`` devuelve 429 en una de cada N peticiones y
+    ``rate_limit_probability`` al azar; ``stats`` cuenta las peticiones.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, tokens_per_second=TOKENS_PER_SECOND,
+                 first_token_delay=FIRST_TOKEN_DELAY, completion_tokens=COMPLETION_TOKENS,
+                 rate_limit_every=0, rate_limit_probability=0.0, retry_after=RETRY_AFTER, seed=None):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.completion_tokens = completion_tokens
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "streamed": 0, "completion_tokens": 0}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self):
+        """Cuenta la petición y decide si se responde con 429"""
+        with self.lock:
+            self.stats["requests"] += 1
+            limited = (
+                (self.rate_limit_every and self.stats["requests"] % self.rate_limit_every == 0)
+                or self.random.random() < self.rate_limit_probability
+            )
+            if limited:
+                self.stats["rate_limited"] += 1
+            return not limited
+
+    def _words(self, count):
+        return [ANSWER_WORDS[i % len(ANSWER_WORDS)] + " " for i in range(count)]
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status, data, headers=None):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not mock._admit():
+                    self._json(
+                        429,
+                        {"error": {"message": "Rate limit reached (mock)", "type": "tokens",
+                                   "code": "rate_limit_exceeded"}},
+                        {"retry-after": f"{mock.retry_after:g}"},
+                    )
+                    return
+
+                model = request.get("model", "mock")
+                count = min(mock.completion_tokens, request.get("max_tokens") or mock.completion_tokens)
+                usage = {
+                    "prompt_tokens": _prompt_tokens(request.get("messages", [])),
+                    "completion_tokens": count,
+                }
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                with mock.lock:
+                    mock.stats["completion_tokens"] += count
+                    mock.stats["streamed"] += bool(request.get("stream"))
+                if request.get("stream"):
+                    self._stream(model, count, usage)
+                else:
+                    time.sleep(mock.first_token_delay + count / mock.tokens_per_second)
+                    self._json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": "".join(mock._words(count))}}],
+                        "usage": usage,
+                    })
+
+            def _stream(self, model, count, usage):
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+                def event(delta, finish_reason=None, **extra):
+                    data = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                        **extra,
+                    }
+                    self.wfile.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                try:
+                    time.sleep(mock.first_token_delay)
+                    event({"role": "assistant", "content": ""})
+                    start = time.perf_counter()
+                    for index, word in enumerate(mock._words(count)):
+                        # Ritmo constante sin acumular el error de cada sleep
+                        delay = start + index / mock.tokens_per_second - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        event({"content": word})
+                    event({}, "stop", x_groq={"id": completion_id, "usage": usage})
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # El cliente cortó el stream
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--tokens-per-second", type=float, default=TOKENS_PER_SECOND)
+    parser.add_argument("--first-token-delay", type=float, default=FIRST_TOKEN_DELAY, help="segundos")
+    parser.add_argument("--completion-tokens", type=int, default=COMPLETION_TOKENS)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="429 en una de cada N peticiones")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.0, help="429 al azar (0 a 1)")
+    parser.add_argument("--retry-after", type=float, default=RETRY_AFTER, help="segundos")
+    args = parser.parse_args(argv)
+
+    server = MockGroqServer(
+        args.host, args.port, args.tokens_per_second, args.first_token_delay, args.completion_tokens,
+        args.rate_limit_every, args.rate_limit_probability, args.retry_after,
+    )
+    print(f"Groq simulado en {server.url} (GROQ_BASE_URL={server.url})")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Normalización de texto para la búsqueda: la misma en los chunks y en las preguntas.
+
+``analyze(texto)`` devuelve la lista de términos con los que se indexa y se
+busca:
+
+1. Repara las palabras cortadas con guion al final de línea por PyPDF2
+   ("diag-\\nnóstico" → "diagnóstico").
+2. Pasa a minúsculas y quita los acentos ("Diagnóstico" → "diagnostico"),
+   así que escribir sin tildes encuentra lo mismo.
+3. Quita las palabras vacías del español ("el", "de", "que"...).
+4. Reduce cada palabra a su raíz con un stemmer ligero del español
+   ("diagnósticos", "diagnosticar" → "diagnostic").
+
+Los chunks se analizan una sola vez al cargarlos y sus términos se guardan
+junto al texto (``chunk["terms"]``, ver ``normalize_chunks``); en cada pregunta
+solo se analiza la pregunta.
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+# Cambia este número si cambia el análisis: invalida los términos guardados
+NORMALIZER_VERSION = 1
+
+# Mínimo de letras que deben quedar después de quitar un sufijo
+MIN_STEM_LENGTH = 3
+
+STOPWORDS = frozenset("""
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun cada como con contra cual
+cuales cuando de del desde donde durante e el ella ellas ellos en entre era eran es esa esas ese
+eso esos esta estaba estan estar estas este esto estos fue fueron ha han hasta hay la las le les
+lo los mas me mi mis mucho muy nada ni no nos nosotras nosotros o os otra otras otro otros para
+pero poco por porque que quien quienes se sea sean ser si sido sin sobre solo son su sus tambien
+tan te tener tengo ti tiene tienen todo todos tu tus un una unas uno unos usted y ya yo
+""".split())
+
+# Sufijos flexivos y derivativos, del más largo al más corto
+_SUFFIXES = sorted("""
+amientos imientos amiento imiento aciones uciones adoras adores ancias encias idades logias
+acion ucion adora ador ancia encia idad logia mente ables ibles istas ismos
+able ible ista ismo osos osas ivos ivas ando iendo ados adas idos idas aron ieron
+oso osa ivo iva ado ada ido ida ar er ir es os as s a o e
+""".split(), key=len, reverse=True)
+
+_HYPHENATION_RE = re.compile(r"(\w)-[ \t]*\n\s*(\w)")
+_SPACED_HYPHEN_RE = re.compile(r"(\w)(?: -|- )(\w)")
+_WORD_RE = re.compile(r"\w+")
+
+
+def repair_hyphenation(text):
+    """Une las palabras que PyPDF2 dejó cortadas con guion al final de una línea.
+
+    También quita el espacio que PyPDF2 suele meter junto al guion de las
+    palabras compuestas ("HOMA -IR", "self- esteem").
+    """
+    return _SPACED_HYPHEN_RE.sub(r"\1-\2", _HYPHENATION_RE.sub(r"\1\2", text))
+
+
+def fold_accents(text):
+    """Minúsculas y sin acentos ni diéresis (la ñ pasa a n)"""
+    decomposed = unicodedata.normalize("NFD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Raíz de una palabra ya sin acentos (quita el sufijo más largo que encaje)"""
+    if word.isdigit():
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:-len(suffix)]
+    return word
+
+
+def analyze(text):
+    """Términos normalizados de un texto (pregunta o chunk), en orden"""
+    words = _WORD_RE.findall(fold_accents(repair_hyphenation(text)))
+    return [stem(word) for word in words if word not in STOPWORDS]
+
+
+def normalize_chunks(chunks, text=lambda chunk: chunk["text"]):
+    """Añade a cada chunk sus términos normalizados (``chunk["terms"]``)"""
+    for chunk in chunks:
+        chunk["terms"] = analyze(text(chunk))
+    return chunks
@@ -0,0 +1,172 @@
+"""Extracción del texto de la guía PDF con caché persistente en disco.
+
+La extracción con PyPDF2 tarda varios segundos por arranque. El resultado se
+guarda en ``CACHE_DIR`` con la clave (hash del PDF, versión del extractor), así
+que un arranque en caliente solo lee un JSON comprimido y un PDF modificado se
+detecta y se vuelve a extraer automáticamente.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import PyPDF2
+
+logger = logging.getLogger(__name__)
+
+# Cambia este número si cambia la forma de extraer el texto de las páginas
+EXTRACTOR_VERSION = f"pypdf2-{PyPDF2.__version__}-1"
+CACHE_DIR = os.getenv("SOFIA_CACHE_DIR", ".cache")
+# Procesos para extraer páginas en paralelo (1 = extracción secuencial)
+PDF_WORKERS = int(os.getenv("SOFIA_PDF_WORKERS", os.cpu_count() or 1))
+# Por debajo de este número de páginas por proceso no compensa repartir
+MIN_PAGES_PER_WORKER = 16
+
+
+def pdf_hash(pdf_path):
+    """Calcula el SHA-256 del contenido del PDF"""
+    digest = hashlib.sha256()
+    with open(pdf_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract_range(pdf_path, start, stop):
+    """Extrae el texto de las páginas [start, stop) del PDF"""
+    with open(pdf_path, "rb") as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _page_ranges(num_pages, parts):
+    """Divide las páginas en ``parts`` rangos contiguos de tamaño parecido"""
+    size, extra = divmod(num_pages, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        stop = start + size + (1 if i < extra else 0)
+        if stop > start:
+            ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def extract_pages(pdf_path, workers=PDF_WORKERS):
+    """Extrae el texto de cada página del PDF, en orden.
+
+    Con ``workers`` > 1 el rango de páginas se reparte entre procesos (cada uno
+    abre su propia copia del PDF) y los resultados se concatenan en orden.
+    """
+    with open(pdf_path, "rb") as file:
+        num_pages = len(PyPDF2.PdfReader(file).pages)
+
+    workers = max(1, min(workers or 1, num_pages // MIN_PAGES_PER_WORKER))
+    if workers == 1:
+        return _extract_range(pdf_path, 0, num_pages)
+
+    ranges = _page_ranges(num_pages, workers)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_extract_range, pdf_path, start, stop) for start, stop in ranges]
+            return [text for future in futures for text in future.result()]
+    except (OSError, BrokenProcessPool) as e:
+        # Entornos sin soporte de multiproceso: se extrae en el proceso actual
+        logger.warning("Extracción paralela no disponible, se usa un solo proceso: %s", e)
+        return _extract_range(pdf_path, 0, num_pages)
+
+
+def _cache_file(pdf_path, digest, cache_dir):
+    name = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(cache_dir, f"{name}-{digest[:16]}-{EXTRACTOR_VERSION}.json.gz")
+
+
+def _read_entry(path, digest):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            entry = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("Caché de extracción ilegible (%s), se regenera: %s", path, e)
+        return None
+
+    if entry.get("pdf_hash") != digest or entry.get("extractor") != EXTRACTOR_VERSION:
+        return None
+    return entry
+
+
+def _write_entry(path, entry):
+    """Escribe la entrada de forma atómica y borra las versiones anteriores del mismo PDF"""
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as file:
+                json.dump(entry, file, ensure_ascii=False, separators=(",", ":"))
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    except OSError as e:
+        # Sin disco escribible la app sigue funcionando, solo sin caché
+        logger.warning("No se pudo guardar la caché de extracción en %s: %s", path, e)
+        return
+
+    # Solo las de este PDF: "guia_sop-<hash>-..." pero no "guia_sop-2024-<hash>-..."
+    name = os.path.basename(path).split(f"-{entry['pdf_hash'][:16]}-")[0]
+    own = re.compile(rf"{re.escape(name)}-[0-9a-f]{{16}}-.+\.json\.gz")
+    for old in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}-*.json.gz")):
+        if old != path and own.fullmatch(os.path.basename(old)):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def _load_entry(pdf_path, cache_dir, workers=PDF_WORKERS):
+    digest = pdf_hash(pdf_path)
+    path = _cache_file(pdf_path, digest, cache_dir)
+    entry = _read_entry(path, digest)
+    if entry is None:
+        entry = {
+            "pdf_hash": digest,
+            "extractor": EXTRACTOR_VERSION,
+            "pages": extract_pages(pdf_path, workers),
+            "chunks": {},
+        }
+        _write_entry(path, entry)
+    return path, entry
+
+
+def load_pages(pdf_path, cache_dir=CACHE_DIR, workers=PDF_WORKERS):
+    """Devuelve el texto por página del PDF, usando la caché en disco si es válida"""
+    _, entry = _load_entry(pdf_path, cache_dir, workers)
+    return entry["pages"]
+
+
+def load_chunks(pdf_path, chunker, chunker_key, cache_dir=CACHE_DIR, workers=PDF_WORKERS):
+    """Devuelve (páginas, chunks) del PDF.
+
+    ``chunker`` recibe la lista de páginas y devuelve una lista serializable en
+    JSON. Su resultado se guarda en la caché bajo ``chunker_key``, que debe
+    cambiar siempre que cambien los parámetros del chunker.
+    """
+    path, entry = _load_entry(pdf_path, cache_dir, workers)
+    if chunker_key not in entry["chunks"]:
+        entry["chunks"][chunker_key] = chunker(entry["pages"])
+        _write_entry(path, entry)
+    return entry["pages"], entry["chunks"][chunker_key]
+
+
+def join_pages(pages):
+    """Une las páginas igual que la extracción original (una línea nueva por página)"""
+    return "\n".join(pages) + "\n" if pages else ""
@@ -0,0 +1,117 @@
+"""Flujo de respuesta de Sofía sin depender de Streamlit.
+
+Guía PDF → chunks → índice BM25 → chunks relevantes → prompt dentro del
+presupuesto de tokens. Lo usan bot3.0.py, la API HTTP (``sofia.api``) y los
+procesos por lotes; un mismo ``ChatPipeline`` se puede compartir entre todas
+las conversaciones del proceso porque no guarda estado por sesión.
+
+El índice de búsqueda puede ser ``"bm25"`` (índice invertido en memoria) o
+``"tfidf"`` (matriz NumPy en disco compartida entre procesos, ver
+``sofia.vector_index``); se elige con ``SOFIA_RETRIEVAL_BACKEND``.
+"""
+import os
+import time
+
+from sofia.chunking import CHUNK_MAX_TOKENS, CHUNK_OVERLAP, CHUNK_SIZE, chunk_pages, chunker_key
+from sofia.compression import COMPRESSED_CONTEXT_TOKENS, ContextCompressor
+from sofia.context import build_messages
+from sofia.diversity import minhash_signatures
+from sofia.normalize import NORMALIZER_VERSION, normalize_chunks
+from sofia.pdf_loader import join_pages, load_chunks, pdf_hash
+from sofia.prompts import PROMPT_VERSION, create_prompt
+from sofia.retrieval import KEYWORDS, BM25Index, category_hits, document_terms, expand_query, find_relevant_chunks
+from sofia.telemetry import TELEMETRY, stage
+from sofia.topic_filter import TopicFilter
+from sofia.vector_index import TfidfIndex
+
+# Valores por defecto (los mismos que usa bot3.0.py)
+PDF_PATH = "guia_sop.pdf"
+MODEL = "llama-3.3-70b-versatile"
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_BACKEND = os.getenv("SOFIA_RETRIEVAL_BACKEND", "bm25")
+RETRIEVAL_DIVERSE = True  # MMR y descarte de chunks casi duplicados
+CONTEXT_COMPRESSION = True  # Enviar solo las oraciones de los chunks que responden la pregunta
+PROMPT_TOKEN_BUDGET = 6000
+GUIDE_TOKEN_BUDGET = 1500
+MAX_TOKENS = 2048
+TEMPERATURE = 0.6
+
+# Cada backend recibe los chunks y la ruta de la guía
+INDEXES = {
+    "bm25": lambda documents, source: BM25Index(documents),
+    "tfidf": lambda documents, source: TfidfIndex.load(documents, source=source),
+}
+
+
+class ChatPipeline:
+    """Guía cargada e indexada, lista para armar los mensajes de cada pregunta"""
+
+    def __init__(self, pdf_path=PDF_PATH, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                 chunk_max_tokens=CHUNK_MAX_TOKENS, top_k=RETRIEVAL_TOP_K,
+                 prompt_budget=PROMPT_TOKEN_BUDGET, guide_budget=GUIDE_TOKEN_BUDGET,
+                 max_tokens=MAX_TOKENS, backend=RETRIEVAL_BACKEND, diverse=RETRIEVAL_DIVERSE,
+                 compress=CONTEXT_COMPRESSION, compressed_budget=COMPRESSED_CONTEXT_TOKENS):
+        start = time.perf_counter()
+        pages, self.chunks = load_chunks(
+            pdf_path,
+            # Los términos normalizados se guardan con los chunks: se analizan una sola vez
+            lambda pages: normalize_chunks(chunk_pages(pages, chunk_size, chunk_overlap, chunk_max_tokens)),
+            f"{chunker_key(chunk_size, chunk_overlap, chunk_max_tokens)}-norm{NORMALIZER_VERSION}",
+        )
+        self.pdf_content = join_pages(pages)
+        self.index = INDEXES[backend](self.chunks, os.path.abspath(pdf_path))
+        self.category_hits = category_hits(self.chunks)
+        # Firmas MinHash para no mandar dos veces el mismo contenido
+        self.signatures = minhash_signatures(document_terms(chunk) for chunk in self.chunks) if diverse else None
+        self.compressor = (
+            ContextCompressor((document_terms(chunk) for chunk in self.chunks), compressed_budget) if compress else None
+        )
+        # Filtro local de preguntas fuera de tema (vocabulario de la guía y palabras clave)
+        self.topic_filter = TopicFilter((document_terms(chunk) for chunk in self.chunks), KEYWORDS)
+        self.guide_hash = pdf_hash(pdf_path)
+        self.prompt_version = PROMPT_VERSION
+        self.top_k = top_k
+        self.prompt_budget = prompt_budget
+        self.guide_budget = guide_budget
+        self.max_tokens = max_tokens
+        TELEMETRY.observe("pdf_load", time.perf_counter() - start)
+
+    def retrieve(self, question):
+        """Chunks de la guía más relevantes para la pregunta"""
+        return find_relevant_chunks(question, self.index, top_k=self.top_k, hits=self.category_hits,
+                                    signatures=self.signatures)
+
+    def is_on_topic(self, question, follow_up=False):
+        """``False`` si la pregunta está claramente fuera del tema y se puede rechazar sin el modelo.
+
+        Con ``follow_up`` (hay turnos anteriores) la pregunta sigue la conversación y pasa.
+        """
+        return self.topic_filter.check(question, follow_up)[0]
+
+    def build_messages(self, history, model, summary="", turn=None, chunks=None):
+        """Mensajes para la API a partir del historial (el último mensaje es la pregunta).
+
+        ``chunks`` son los de ``retrieve`` si ya se buscaron (por ejemplo para el
+        router); si no se pasan, se buscan aquí. Con compresión solo se envían las mejores oraciones de los chunks
+        encontrados. Si ningún chunk coincide con la pregunta el prompt lo dice
+        (``NO_CONTEXT``) en vez de mandar otra parte de la guía. Con ``turn`` (``sofia.telemetry``) se mide cada etapa.
+        """
+        question = history[-1]["content"] if history else ""
+        if chunks is None:
+            with stage(turn, "retrieve"):
+                chunks = self.retrieve(question)
+        relevant_chunks = chunks
+        if self.compressor and relevant_chunks:
+            with stage(turn, "compress"):
+                relevant_chunks = self.compressor.compress(expand_query(question), relevant_chunks)
+        with stage(turn, "prompt"):
+            return build_messages(
+                create_prompt,
+                relevant_chunks,
+                history,
+                model,
+                self.prompt_budget,
+                max_tokens=self.max_tokens,
+                context_budget=self.guide_budget,
+                summary=summary,
+            )
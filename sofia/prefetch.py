@@ -0,0 +1,138 @@
+"""Respuesta anticipada del tema guiado seleccionado.
+
+Entre que la usuaria elige un tema en el menú y pulsa "📤 Preguntar" pasan
+unos segundos. ``SpeculativeAnswer`` aprovecha ese tiempo: al seleccionar el
+tema busca el contexto y arma el prompt en un hilo aparte y, si el
+presupuesto lo permite, empieza a generar la respuesta. Al pulsar el botón la
+respuesta ya está (o va por la mitad) y se muestra sin esperar al modelo.
+
+Cada anticipación se identifica con una clave (pregunta, modelo del menú y
+largo de la conversación) y recuerda el modelo con el que se pidió, para que
+al pulsar el botón no se vuelva a elegir otro (``model``). Si la selección cambia antes de pulsar, la generación en curso
+se cancela. El presupuesto limita lo que se gasta en adivinar:
+
+- solo se genera si al modelo le queda al menos ``MIN_HEADROOM`` de su
+  capacidad por minuto (las preguntas reales van primero),
+- tras ``MAX_WASTED`` respuestas anticipadas que no se usaron, solo se
+  anticipa la búsqueda del contexto.
+"""
+import logging
+import threading
+
+from sofia.groq_client import LIMITER
+from sofia.streaming import CURSOR
+
+logger = logging.getLogger(__name__)
+
+MIN_HEADROOM = 0.5
+MAX_WASTED = 3
+POLL_INTERVAL = 0.05  # Segundos entre actualizaciones mientras se termina una respuesta en curso
+
+
+class _Speculation:
+    def __init__(self, key, requested):
+        self.key = key
+        self.requested = requested  # El modelo con el que se anticipó
+        self.messages = None
+        self.model = None  # El que respondió (puede ser el de respaldo)
+        self.text = ""
+        self.generating = False
+        self.error = None
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+
+
+class SpeculativeAnswer:
+    """Una respuesta anticipada por sesión, generada en un hilo aparte"""
+
+    def __init__(self, client, limiter=LIMITER, min_headroom=MIN_HEADROOM, max_wasted=MAX_WASTED):
+        self.client = client
+        self.limiter = limiter
+        self.min_headroom = min_headroom
+        self.max_wasted = max_wasted
+        self.wasted = 0
+        self._current = None
+        self._lock = threading.Lock()
+
+    def start(self, key, build_messages, **request):
+        """Anticipa la respuesta identificada por ``key``.
+
+        ``build_messages()`` arma los mensajes del prompt (se llama en el hilo)
+        y ``request`` son los demás argumentos de ``chat.completions.create``.
+        Si ya hay una anticipación con la misma clave no hace nada; si hay otra,
+        la cancela.
+        """
+        with self._lock:
+            if self._current is not None and self._current.key == key:
+                return
+            self._cancel()
+            speculation = self._current = _Speculation(key, request["model"])
+        generate = self.wasted < self.max_wasted and self.limiter.headroom(request["model"]) >= self.min_headroom
+        threading.Thread(target=self._run, args=(speculation, build_messages, generate, request), daemon=True).start()
+
+    def _run(self, speculation, build_messages, generate, request):
+        try:
+            speculation.messages = build_messages()
+            if not generate or speculation.cancelled.is_set():
+                return
+            speculation.generating = True
+            speculation.model = request["model"]
+            stream = self.client.chat.completions.create(stream=True, messages=speculation.messages, **request)
+            try:
+                for chunk in stream:
+                    if speculation.cancelled.is_set():
+                        return
+                    speculation.model = getattr(chunk, "model", None) or speculation.model
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        speculation.text += chunk.choices[0].delta.content
+            finally:
+                close = getattr(stream, "close", None)
+                if close:
+                    close()
+        except Exception as e:
+            speculation.error = e
+            logger.warning("No se pudo anticipar la respuesta: %s", e)
+        finally:
+            speculation.done.set()
+
+    def _cancel(self):
+        if self._current is None:
+            return
+        if self._current.generating and not self._current.cancelled.is_set():
+            self.wasted += 1
+        self._current.cancelled.set()
+        self._current = None
+
+    def model(self, key):
+        """Modelo con el que se anticipó ``key``, o ``None`` si no hay anticipación para esa clave"""
+        with self._lock:
+            if self._current is not None and self._current.key == key:
+                return self._current.requested
+        return None
+
+    def cancel(self):
+        """Descarta la anticipación en curso (la selección cambió)"""
+        with self._lock:
+            self._cancel()
+
+    def take(self, key, placeholder=None):
+        """Devuelve ``(respuesta, mensajes, modelo)`` anticipados para ``key``.
+
+        Si la respuesta se está generando, espera a que termine mostrándola en
+        ``placeholder``. ``respuesta`` es ``None`` si no se generó o falló,
+        ``mensajes`` es ``None`` si no hay anticipación para esa clave y
+        ``modelo`` es el que respondió.
+        """
+        with self._lock:
+            speculation = self._current
+            if speculation is None or speculation.key != key:
+                self._cancel()
+                return None, None, None
+            self._current = None
+
+        while not speculation.done.wait(POLL_INTERVAL):
+            if placeholder is not None and speculation.text:
+                placeholder.markdown(speculation.text + CURSOR)
+        if speculation.error is not None or not speculation.generating:
+            return None, speculation.messages, None
+        return speculation.text, speculation.messages, speculation.model
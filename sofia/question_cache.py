@@ -0,0 +1,196 @@
+"""Caché de respuestas para preguntas casi iguales.
+
+La misma duda llega escrita de muchas formas ("¿qué es el SOP?", "que es sop",
+"explícame el síndrome de ovario poliquístico") y cada forma pasaba por la
+búsqueda y el modelo grande. ``QuestionCache`` guarda la respuesta de las
+preguntas de primer turno (sin historial, así que la respuesta solo depende
+de la pregunta) y la reutiliza para las preguntas parecidas:
+
+1. La pregunta se normaliza como en la búsqueda (``sofia.normalize``), las
+   formas de nombrar el síndrome se cambian por ``sop`` y se quitan las
+   palabras de relleno ("explícame", "dime", "por favor"...). Se conservan
+   las palabras de tiempo ("antes", "durante"...), aunque sean palabras
+   vacías, y se marca la negación.
+2. Con sus términos se calcula una firma MinHash (``sofia.diversity``) que se
+   reparte en ``BANDS`` bandas (LSH): solo se comparan las preguntas que
+   comparten alguna banda.
+3. Entre esas, la de mayor Jaccard exacto de términos sirve si llega a
+   ``SIMILARITY_THRESHOLD`` y es del mismo modelo, guía y versión del prompt.
+   Solo pueden cambiar las palabras sin información ("oye", "gracias",
+   "tengo una duda"..., ``LOW_INFORMATION``): cualquier otra palabra distinta
+   es otra pregunta. "¿Puedo tomar inositol durante el embarazo?" no es
+   "... metformina ...", ni "... durante la lactancia", ni "... si tengo
+   hipotiroidismo", "... si mi hermana tiene SOP" o "... y diabetes". Las
+   preguntas de hasta ``SHORT_QUESTION_TERMS`` términos solo sirven si
+   coinciden todos.
+
+Guarda como máximo ``CAPACITY`` preguntas y descarta la usada hace más
+tiempo. Las respuestas de otra guía u otro prompt se descartan al
+encontrarlas o con ``invalidate``.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from sofia.diversity import NUM_PERM, minhash
+from sofia.normalize import STOPWORDS, analyze, fold_accents, stem
+
+CAPACITY = 512
+SIMILARITY_THRESHOLD = 0.7
+BANDS = 16  # NUM_PERM / BANDS filas por banda: candidatas desde ~0.5 de similitud
+SHORT_QUESTION_TERMS = 4  # Hasta este número de términos, solo vale la misma pregunta
+
+# Formas de nombrar el síndrome, todas equivalentes a "sop"
+SYNONYMS = ["síndrome de ovario poliquístico", "síndrome de ovarios poliquísticos", "ovario poliquístico",
+            "ovarios poliquísticos", "poliquistosis ovárica", "pcos", "pco"]
+# Palabras que no cambian lo que se pregunta
+FILLER = frozenset(analyze(
+    "explícame explica explicar dime cuéntame háblame por favor quiero quisiera saber significa "
+    "podrías decir información info acerca hola"
+))
+# Palabras de tiempo: son palabras vacías para la búsqueda, pero "antes del embarazo" no es "durante"
+TEMPORAL_WORDS = frozenset("antes durante despues desde hasta cuando mientras tras".split())
+# Verbos que dan la vuelta a la pregunta: "dejar de tomar", "evitar embarazarme"
+POLARITY_WORDS = "dejar evitar parar suspender quitar interrumpir prevenir"
+NEGATION = "¬"
+_NEGATIONS = {"no", "nunca", "sin", "jamas", "tampoco", "ningun", "ninguna"}
+_WORD_RE = re.compile(r"\w+")
+_SYNONYM_TERMS = sorted({tuple(analyze(phrase)) for phrase in SYNONYMS}, key=len, reverse=True)
+# Términos que cambian el sentido aunque parezcan pequeños
+STRICT_WORDS = TEMPORAL_WORDS | frozenset(analyze(POLARITY_WORDS)) | {NEGATION}
+# Lo único en que pueden diferir dos preguntas para compartir respuesta. Es una lista cerrada:
+# la guía está en inglés y su vocabulario no dice qué palabras en español importan
+LOW_INFORMATION = frozenset(analyze(
+    "gracias porfa porfis oye duda dudas pregunta preguntita amiga sofía"
+)) - STRICT_WORDS
+
+
+def _terms(question):
+    """Como ``analyze``, pero conservando las palabras de tiempo sin reducir"""
+    terms = []
+    for word in _WORD_RE.findall(fold_accents(question)):
+        if word in TEMPORAL_WORDS:
+            terms.append(word)
+        elif word not in STOPWORDS:
+            terms.append(stem(word))
+    return terms
+
+
+def question_terms(question):
+    """Términos normalizados de la pregunta que deciden si dos preguntas son la misma"""
+    terms = _terms(question)
+    canonical = []
+    i = 0
+    while i < len(terms):
+        for synonym in _SYNONYM_TERMS:
+            if tuple(terms[i:i + len(synonym)]) == synonym:
+                canonical.append("sop")
+                i += len(synonym)
+                break
+        else:
+            if terms[i] not in FILLER:
+                canonical.append(terms[i])
+            i += 1
+    # "¿puedo tomar inositol si no tengo SOP?" no es "... si tengo SOP?"
+    if _NEGATIONS & set(_WORD_RE.findall(fold_accents(question))):
+        canonical.append(NEGATION)
+    return frozenset(canonical)
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def similarity(a, b):
+    """Jaccard de dos conjuntos de términos, o 0 si difieren en algún término con información"""
+    if not (a ^ b) <= LOW_INFORMATION:
+        return 0.0
+    if min(len(a), len(b)) <= SHORT_QUESTION_TERMS and a != b:
+        return 0.0
+    return _jaccard(a, b)
+
+
+class QuestionCache:
+    """Respuestas de preguntas de primer turno, buscadas por similitud (MinHash + LSH)"""
+
+    def __init__(self, capacity=CAPACITY, threshold=SIMILARITY_THRESHOLD, bands=BANDS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self._entries = OrderedDict()  # (términos, modelo) -> entrada, de la menos a la más usada
+        self._buckets = {}  # (banda, valores) -> claves de las entradas
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bands(self, terms):
+        signature = minhash(sorted(terms), size=1)
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for band in entry["bands"]:
+            keys = self._buckets.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._buckets[band]
+
+    def get(self, question, model, guide_hash, prompt_version):
+        """Respuesta guardada de una pregunta casi igual, o ``None``"""
+        terms = question_terms(question)
+        if not terms:
+            return None
+        with self._lock:
+            candidates = set()
+            for band in self._bands(terms):
+                candidates |= self._buckets.get(band, set())
+            best, best_score = None, self.threshold
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                if entry["guide_hash"] != guide_hash or entry["prompt_version"] != prompt_version:
+                    self._remove(candidate)  # De otra guía u otro prompt: ya no sirve
+                    continue
+                score = similarity(terms, candidate[0])
+                if candidate[1] == model and score >= best_score:
+                    best, best_score = candidate, score
+            if best is None:
+                return None
+            self._entries.move_to_end(best)
+            return self._entries[best]["answer"]
+
+    def put(self, question, model, guide_hash, prompt_version, answer):
+        terms = question_terms(question)
+        if not terms or not answer:
+            return
+        key = (terms, model)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            bands = self._bands(terms)
+            self._entries[key] = {
+                "guide_hash": guide_hash, "prompt_version": prompt_version, "answer": answer, "bands": bands,
+            }
+            for band in bands:
+                self._buckets.setdefault(band, set()).add(key)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, guide_hash=None, prompt_version=None):
+        """Borra las respuestas de otra guía u otra versión del prompt; devuelve cuántas"""
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if (guide_hash is not None and entry["guide_hash"] != guide_hash)
+                or (prompt_version is not None and entry["prompt_version"] != prompt_version)
+            ]
+            for key in stale:
+                self._remove(key)
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
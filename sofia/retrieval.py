@@ -0,0 +1,126 @@
+"""Búsqueda de los chunks de la guía más relevantes para una pregunta.
+
+Chunks y preguntas pasan por el mismo análisis (``sofia.normalize``): sin
+acentos, sin palabras vacías y reducidos a su raíz.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from sofia.chunking import chunk_text
+from sofia.diversity import select_diverse
+from sofia.keywords import KeywordAutomaton, load_keywords
+from sofia.normalize import analyze
+
+# Categorías de palabras clave (sofia/keywords.json): si la pregunta menciona
+# alguna palabra de una categoría, se añaden las demás a la búsqueda y los
+# chunks que tratan esa categoría suben en el orden
+KEYWORDS = load_keywords()
+AUTOMATON = KeywordAutomaton(KEYWORDS)
+
+# Peso de la categoría al reordenar: un chunk que trata todas las categorías
+# de la pregunta multiplica su puntuación por 1 + CATEGORY_BOOST
+CATEGORY_BOOST = 0.25
+# Candidatos por cada chunk pedido que se reordenan con las categorías
+CANDIDATES_PER_RESULT = 3
+
+
+def tokenize(text):
+    """Términos normalizados del texto (ver ``sofia.normalize.analyze``)"""
+    return analyze(text)
+
+
+def document_terms(doc):
+    """Términos de un chunk: los precalculados al cargar la guía si los tiene"""
+    if isinstance(doc, dict) and "terms" in doc:
+        return doc["terms"]
+    return analyze(chunk_text(doc))
+
+
+class BM25Index:
+    """Índice invertido con puntuación BM25 sobre una lista de documentos.
+
+    Las listas de postings guardan ya el peso BM25 de cada término en cada
+    documento, así que una búsqueda solo suma los pesos de los documentos que
+    contienen los términos de la pregunta.
+    """
+
+    def __init__(self, documents, k1=1.5, b=0.75):
+        self.documents = documents
+        self.postings = defaultdict(list)
+
+        doc_terms = [Counter(document_terms(doc)) for doc in documents]
+        lengths = [sum(terms.values()) for terms in doc_terms]
+        avg_length = sum(lengths) / len(lengths) if lengths else 0.0
+        doc_freq = Counter(term for terms in doc_terms for term in terms)
+        num_docs = len(documents)
+
+        for doc_id, terms in enumerate(doc_terms):
+            norm = k1 * (1 - b + b * lengths[doc_id] / avg_length) if avg_length else k1
+            for term, tf in terms.items():
+                idf = math.log(1 + (num_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                self.postings[term].append((doc_id, idf * tf * (k1 + 1) / (tf + norm)))
+
+        self.postings = dict(self.postings)
+
+    def search(self, terms, top_k=3):
+        """Devuelve hasta ``top_k`` pares (puntuación, id de documento), de mayor a menor"""
+        scores = defaultdict(float)
+        for term in set(terms):
+            for doc_id, weight in self.postings.get(term, ()):
+                scores[doc_id] += weight
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, doc_id) for doc_id, score in best]
+
+
+def query_categories(terms, automaton=AUTOMATON):
+    """Índices de las categorías que aparecen en los términos de la pregunta"""
+    return sorted({category for _, category in automaton.hits(terms)})
+
+
+def _expand(query, automaton):
+    terms = tokenize(query)
+    categories = query_categories(terms, automaton)
+    for category in categories:
+        terms.extend(automaton.category_terms[category])
+    return terms, categories
+
+
+def expand_query(query, automaton=AUTOMATON):
+    """Normaliza la pregunta y añade los términos de las categorías que menciona"""
+    return _expand(query, automaton)[0]
+
+
+def category_hits(documents, automaton=AUTOMATON):
+    """Matriz chunks × categorías con las apariciones de las palabras clave en cada chunk"""
+    return automaton.hit_matrix(document_terms(doc) for doc in documents)
+
+
+def _boost_categories(results, hits, categories):
+    """Sube los candidatos que tratan las categorías de la pregunta"""
+    doc_ids = np.array([doc_id for _, doc_id in results])
+    covered = (hits[np.ix_(doc_ids, categories)] > 0).mean(axis=1)
+    rescored = [(score * (1 + CATEGORY_BOOST * coverage), doc_id) for (score, doc_id), coverage in zip(results, covered)]
+    return sorted(rescored, key=lambda item: item[0], reverse=True)
+
+
+def find_relevant_chunks(query, index, top_k=3, hits=None, signatures=None, automaton=AUTOMATON):
+    """Busca los chunks más relevantes para la pregunta.
+
+    ``index`` puntúa los términos (BM25 o TF-IDF). Si se pasa ``hits``, la
+    matriz de ``category_hits``, los candidatos que tratan las categorías de la
+    pregunta suben en el orden; es solo una consulta a la matriz. Con
+    ``signatures`` (firmas MinHash de ``sofia.diversity``) se eligen con MMR y
+    sin casi duplicados.
+    """
+    terms, categories = _expand(query, automaton)
+    boost = hits is not None and bool(categories)
+    rerank = boost or signatures is not None
+    results = index.search(terms, top_k * CANDIDATES_PER_RESULT if rerank else top_k)
+    if boost and results:
+        results = _boost_categories(results, hits, categories)
+    if signatures is not None:
+        results = select_diverse(results, signatures, top_k)
+    return [index.documents[doc_id] for score, doc_id in results[:top_k]]
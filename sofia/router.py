@@ -0,0 +1,124 @@
+"""Elección del modelo para cada pregunta: llama-3.3-70b-versatile o llama-3.1-8b-instant.
+
+Las preguntas simples ("¿Qué es el SOP?") no necesitan el modelo grande. El
+``ModelRouter`` suma puntos de dificultad por:
+
+- pregunta larga o con varias partes,
+- palabras que piden razonar (por qué, comparar, diferencia, riesgo...),
+- poca confianza de la búsqueda (los chunks encontrados cubren pocos
+  términos de la pregunta),
+- conversación larga (la respuesta depende de lo anterior),
+
+y manda al modelo pequeño las preguntas sin puntos. Si al modelo grande le
+queda poca capacidad por minuto (``LIMITER.headroom``), también las de un
+punto. Si la respuesta del pequeño no pasa ``answer_ok`` se puede pedir otra
+vez al grande, salvo que sea una de las respuestas fijas del prompt (son
+cortas a propósito) o que el pequeño haya respondido como respaldo del grande.
+"""
+import hashlib
+import logging
+import re
+
+from sofia.groq_client import LIMITER
+from sofia.normalize import STOPWORDS, analyze, fold_accents
+from sofia.prompts import NOT_IN_GUIDE_REPLY, OFF_TOPIC_REPLY
+from sofia.retrieval import document_terms, expand_query
+
+logger = logging.getLogger(__name__)
+
+AUTO_MODEL = "auto"
+LARGE_MODEL = "llama-3.3-70b-versatile"
+SMALL_MODEL = "llama-3.1-8b-instant"
+
+LONG_QUESTION_TERMS = 8  # Términos a partir de los cuales la pregunta cuenta como larga
+MIN_CONFIDENCE = 0.5  # Fracción de términos de la pregunta que deben aparecer en los chunks
+LONG_HISTORY_TURNS = 4  # Turnos previos a partir de los cuales la conversación cuenta como larga
+LOW_HEADROOM = 0.25  # Capacidad del modelo grande por debajo de la cual se ahorra
+MIN_ANSWER_CHARS = 200  # Respuestas más cortas se consideran fallidas
+MIN_SPANISH_RATIO = 0.08  # Fracción mínima de palabras vacías del español en la respuesta
+
+_REASONING_RE = re.compile(
+    r"\b(por que|porque|compar\w*|diferencia\w*|mejor|peor|riesgo\w*|combin\w*|a la vez|"
+    r"mientras|embaraz\w*|interacc\w*|efectos? secundarios?|dosis|deberia|conviene|explica\w* por)\b"
+)
+_WORD_RE = re.compile(r"\w+")
+# Primera oración de cada respuesta fija del prompt: el modelo a veces añade algo alrededor
+_CANNED_MARKERS = tuple(fold_accents(reply.split(".")[0]) for reply in (OFF_TOPIC_REPLY, NOT_IN_GUIDE_REPLY))
+
+
+def is_canned(answer):
+    """``True`` si la respuesta es una de las fijas del prompt (fuera de tema o no está en la guía)"""
+    text = " ".join(fold_accents(answer).split())
+    return any(marker in text for marker in _CANNED_MARKERS)
+
+
+def answer_ok(answer):
+    """Comprobaciones básicas de una respuesta: largo, idioma, que no se repita ni quede cortada"""
+    text = answer.strip()
+    if len(text) < MIN_ANSWER_CHARS:
+        return False
+    words = _WORD_RE.findall(fold_accents(text))
+    if sum(word in STOPWORDS for word in words) / max(len(words), 1) < MIN_SPANISH_RATIO:
+        return False
+    lines = [line.strip() for line in text.splitlines() if len(line.strip()) > 20]
+    if len(lines) >= 4 and len(set(lines)) < len(lines) / 2:
+        return False
+    # Cortada a media oración (salvo que termine en un punto de una lista)
+    last_line = text.splitlines()[-1].lstrip()
+    return not (text[-1].isalnum() and not last_line.startswith(("-", "*", "•")))
+
+
+class ModelRouter:
+    """Elige entre el modelo grande y el pequeño según la dificultad de la pregunta"""
+
+    def __init__(self, limiter=LIMITER, large=LARGE_MODEL, small=SMALL_MODEL):
+        self.limiter = limiter
+        self.large = large
+        self.small = small
+
+    def difficulty(self, question, chunks, history_turns=0):
+        """Puntos de dificultad de la pregunta y el motivo de cada uno"""
+        terms = set(analyze(question))
+        reasons = []
+        if len(terms) >= LONG_QUESTION_TERMS or question.count("?") > 1:
+            reasons.append("long")
+        if _REASONING_RE.search(fold_accents(question)):
+            reasons.append("reasoning")
+        if len(terms) >= 2:
+            # Términos de la pregunta (o de sus categorías, en inglés como la guía) que están en los chunks
+            found = set()
+            for chunk in chunks:
+                found.update(document_terms(chunk))
+            if len(set(expand_query(question)) & found) / len(terms) < MIN_CONFIDENCE:
+                reasons.append("low_confidence")
+        if history_turns >= LONG_HISTORY_TURNS:
+            reasons.append("long_history")
+        return reasons
+
+    def route(self, question, chunks, history_turns=0):
+        """Devuelve ``(modelo, detalle)`` para la pregunta"""
+        reasons = self.difficulty(question, chunks, history_turns)
+        headroom = self.limiter.headroom(self.large)
+        if not reasons or (len(reasons) == 1 and headroom < LOW_HEADROOM):
+            model = self.small
+        else:
+            model = self.large
+        details = {"reasons": reasons, "headroom": round(headroom, 3)}
+        # Sin el texto de la pregunta: solo su longitud y un hash para agrupar repeticiones
+        logger.info(
+            "router model=%s reasons=%s headroom=%.3f chars=%d question_hash=%s",
+            model, ",".join(reasons) or "-", details["headroom"], len(question),
+            hashlib.sha256(question.encode("utf-8")).hexdigest()[:12],
+        )
+        return model, details
+
+    def should_retry(self, model, answer, answered_model=None):
+        """``True`` si la respuesta del modelo pequeño falla y conviene pedirla al grande.
+
+        ``model`` es el modelo pedido y ``answered_model`` el que respondió: si
+        no coinciden, el pequeño respondió como respaldo porque el grande llegó
+        al límite, y pedírsela otra vez al grande no sirve.
+        """
+        if model != self.small or (answered_model is not None and answered_model != model):
+            return False
+        return not is_canned(answer) and not answer_ok(answer)
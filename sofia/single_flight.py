@@ -0,0 +1,243 @@
+"""Una sola petición a Groq para peticiones idénticas en curso.
+
+Cuando muchas usuarias pulsan a la vez el mismo tema guiado ("🔍 ¿Qué es el
+SOP?") cada sesión manda la misma petición: mismo modelo, mismo prompt,
+mismo historial y misma temperatura. ``CoalescingClient`` envuelve al cliente
+(por fuera de ``RateLimitedClient``, para que las copias no gasten cuota) y,
+mientras una petición está en curso, las idénticas que llegan se suman a ella
+en vez de salir a la API:
+
+- sin streaming, todas reciben la misma respuesta (o el mismo error),
+- con streaming, un hilo lee el stream de Groq una sola vez y cada sesión
+  recibe todos los fragmentos desde el principio, a su ritmo.
+
+La clave es un hash de todos los argumentos de la petición. En cuanto la
+respuesta termina la petición deja de estar en curso: esto no es una caché
+(para eso está ``sofia.answer_cache``). Cada petición sumada se cuenta como
+``coalesced`` en ``METRICS``. ``AsyncCoalescingClient`` hace lo mismo en la
+API con ``asyncio``.
+"""
+import asyncio
+import hashlib
+import inspect
+import json
+import threading
+from types import SimpleNamespace
+
+from sofia.groq_client import METRICS
+
+
+def request_key(request):
+    """Hash de los argumentos de la petición (modelo, mensajes, temperatura, ...)"""
+    data = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class _Flight:
+    """Una petición en curso y lo que va devolviendo"""
+
+    def __init__(self):
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.streaming = False  # El stream de Groq ya se abrió
+        self.done = False
+        self.abandoned = False  # La petición original se interrumpió antes de tener respuesta
+
+
+class _FanOut:
+    """Iterador de un stream compartido: repite los fragmentos desde el principio"""
+
+    def __init__(self, flight, condition):
+        self.flight = flight
+        self.condition = condition
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.flight.chunks) and not self.flight.done:
+                    self.condition.wait()
+                if index < len(self.flight.chunks):
+                    chunk = self.flight.chunks[index]
+                    index += 1
+                elif self.flight.error is not None:
+                    raise self.flight.error
+                else:
+                    return
+            yield chunk
+
+    def close(self):
+        """El stream de Groq lo cierra quien lo lee, cuando termina para todas"""
+
+
+class CoalescingClient:
+    """Envoltorio de un cliente síncrono que junta las peticiones idénticas en curso"""
+
+    def __init__(self, client, metrics=METRICS):
+        self.client = client
+        self.metrics = metrics
+        self._flights = {}
+        self._condition = threading.Condition()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _land(self, key, flight):
+        with self._condition:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._condition.notify_all()
+
+    def create(self, **request):
+        key = request_key(request)
+        with self._condition:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.metrics.inc("coalesced")
+                # Esperar a que la petición original tenga respuesta o stream
+                while not (flight.done or flight.streaming):
+                    self._condition.wait()
+        if not leader and flight.abandoned:
+            # Nadie va a responder por ella: la siguiente la pide de nuevo
+            return self.create(**request)
+
+        if leader:
+            try:
+                result = self.client.chat.completions.create(**request)
+            except Exception as e:
+                flight.error = e
+                self._land(key, flight)
+                raise
+            except BaseException:
+                # Interrumpida (fin del script, KeyboardInterrupt...): sin esto las idénticas esperarían siempre
+                flight.abandoned = True
+                self._land(key, flight)
+                raise
+            if not request.get("stream"):
+                flight.result = result
+                self._land(key, flight)
+                return result
+            with self._condition:
+                flight.streaming = True
+                self._condition.notify_all()
+            threading.Thread(target=self._pump, args=(key, flight, result), daemon=True).start()
+        elif not flight.streaming:
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        return _FanOut(flight, self._condition)
+
+    def _pump(self, key, flight, stream):
+        """Lee el stream de Groq una vez y reparte los fragmentos (en un hilo aparte)"""
+        try:
+            for chunk in stream:
+                with self._condition:
+                    flight.chunks.append(chunk)
+                    self._condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            self._land(key, flight)
+
+
+class _AsyncFanOut:
+    def __init__(self, flight, condition):
+        self.flight = flight
+        self.condition = condition
+
+    async def __aiter__(self):
+        index = 0
+        while True:
+            async with self.condition:
+                await self.condition.wait_for(lambda: index < len(self.flight.chunks) or self.flight.done)
+                if index < len(self.flight.chunks):
+                    chunk = self.flight.chunks[index]
+                    index += 1
+                elif self.flight.error is not None:
+                    raise self.flight.error
+                else:
+                    return
+            yield chunk
+
+
+class AsyncCoalescingClient:
+    """Igual que ``CoalescingClient`` para clientes asíncronos (un solo event loop)"""
+
+    def __init__(self, client, metrics=METRICS):
+        self.client = client
+        self.metrics = metrics
+        self._flights = {}
+        self._condition = None
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def _land(self, key, flight):
+        async with self._condition:
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._condition.notify_all()
+
+    async def create(self, **request):
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        key = request_key(request)
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = self._flights[key] = _Flight()
+            try:
+                result = await self.client.chat.completions.create(**request)
+            except Exception as e:
+                flight.error = e
+                await self._land(key, flight)
+                raise
+            except BaseException:
+                # Cancelada (la clienta se desconectó o se agotó el tiempo). Se quita ya, sin
+                # esperar al lock, y se avisa a las que esperan desde otra tarea: esta ya está cancelada
+                flight.abandoned = True
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task = asyncio.ensure_future(self._land(key, flight))
+                raise
+            if not request.get("stream"):
+                flight.result = result
+                await self._land(key, flight)
+                return result
+            async with self._condition:
+                flight.streaming = True
+                self._condition.notify_all()
+            flight.task = asyncio.create_task(self._pump(key, flight, result))
+        else:
+            self.metrics.inc("coalesced")
+            async with self._condition:
+                await self._condition.wait_for(lambda: flight.done or flight.streaming)
+            if flight.abandoned:
+                # Nadie va a responder por ella: la siguiente la pide de nuevo
+                return await self.create(**request)
+            if not flight.streaming:
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+
+        return _AsyncFanOut(flight, self._condition)
+
+    async def _pump(self, key, flight, stream):
+        try:
+            async for chunk in stream:
+                async with self._condition:
+                    flight.chunks.append(chunk)
+                    self._condition.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            close = getattr(stream, "close", None)
+            if close and inspect.isawaitable(closing := close()):
+                await closing
+            await self._land(key, flight)
@@ -0,0 +1,206 @@
+"""Streaming de las respuestas del modelo hacia un placeholder de Streamlit.
+
+Cada ``placeholder.markdown`` reenvía la respuesta completa por el websocket y
+el navegador la vuelve a interpretar, así que actualizar en cada fragmento
+cuesta O(n²) bytes por respuesta. ``ThrottledPlaceholder`` agrupa los
+fragmentos y solo actualiza cada ``FLUSH_INTERVAL`` segundos (o antes si se
+juntaron ``FLUSH_CHARS`` caracteres nuevos), con una última actualización al
+terminar.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CURSOR = "▌"
+FLUSH_INTERVAL = 0.05  # Segundos mínimos entre actualizaciones del placeholder
+FLUSH_CHARS = 512  # Caracteres nuevos que fuerzan una actualización antes de tiempo
+_WORD_RE = re.compile(r"\S+\s*|\s+")
+_DONE = object()
+
+
+class ThrottledPlaceholder:
+    """Envoltorio de un placeholder que agrupa las actualizaciones seguidas.
+
+    ``markdown`` guarda el texto y solo lo envía si pasó ``interval`` desde el
+    último envío o hay ``max_chars`` caracteres nuevos; ``flush`` envía lo
+    pendiente. ``updates`` cuenta los envíos reales y ``seconds`` el tiempo
+    pasado dentro de ``placeholder.markdown``.
+    """
+
+    def __init__(self, placeholder, interval=FLUSH_INTERVAL, max_chars=FLUSH_CHARS, clock=time.perf_counter):
+        self.placeholder = placeholder
+        self.interval = interval
+        self.max_chars = max_chars
+        self.clock = clock
+        self.updates = 0
+        self.seconds = 0.0
+        self._text = None
+        self._sent = None
+        self._sent_chars = 0
+        self._last = None
+
+    def markdown(self, text):
+        self._text = text
+        if (
+            self._last is None
+            or self.clock() - self._last >= self.interval
+            or len(text) - self._sent_chars >= self.max_chars
+        ):
+            self.flush()
+
+    def flush(self, text=None):
+        """Envía el texto pendiente (o ``text``) si cambió desde el último envío"""
+        if text is not None:
+            self._text = text
+        if self._text is None or self._text == self._sent:
+            return
+        start = time.perf_counter()
+        self.placeholder.markdown(self._text)
+        self.seconds += time.perf_counter() - start
+        self._sent = self._text
+        self._sent_chars = len(self._text)
+        self._last = self.clock()
+        self.updates += 1
+
+
+class NullPlaceholder:
+    """Placeholder que no muestra nada (benchmarks y pruebas de carga sin Streamlit)"""
+
+    def markdown(self, text):
+        pass
+
+
+def _delta_text(chunk):
+    if chunk.choices and chunk.choices[0].delta.content:
+        return chunk.choices[0].delta.content
+    return ""
+
+
+def _track_model(stream, stats):
+    """Anota en ``stats["model"]`` el modelo que dice cada fragmento (el de respaldo, si lo hubo)"""
+    for chunk in stream:
+        stats["model"] = getattr(chunk, "model", None) or stats["model"]
+        yield chunk
+
+
+def _word_delay(word):
+    """Pausa del efecto de escritura: más larga después de puntos y comas"""
+    word = word.rstrip()
+    if word.endswith(('.', '?', '!')):
+        return 0.08
+    if word.endswith(','):
+        return 0.04
+    return 0.02
+
+
+def _read_stream(stream, out):
+    """Pasa los fragmentos del stream a la cola (se ejecuta en un hilo aparte)"""
+    try:
+        for chunk in stream:
+            text = _delta_text(chunk)
+            if text:
+                out.put(text)
+    except Exception as e:
+        out.put(e)
+    finally:
+        out.put(_DONE)
+
+
+def _show_stream(stream, placeholder, on_first_token):
+    full_response = ""
+    for chunk in stream:
+        text = _delta_text(chunk)
+        if text:
+            if not full_response:
+                on_first_token()
+            full_response += text
+            placeholder.markdown(full_response + CURSOR)
+    return full_response
+
+
+def _show_stream_typing(stream, placeholder, on_first_token):
+    """Muestra el stream palabra por palabra sin quedarse nunca atrás de la generación.
+
+    Las pausas entre palabras solo ocurren mientras se espera el siguiente
+    fragmento: en cuanto llega texto nuevo, lo pendiente se muestra de golpe.
+    """
+    deltas = queue.Queue()
+    threading.Thread(target=_read_stream, args=(stream, deltas), daemon=True).start()
+
+    full_response = ""
+    displayed = ""
+    pending = []
+    while True:
+        try:
+            item = deltas.get(timeout=_word_delay(pending[0]) if pending else None)
+        except queue.Empty:
+            displayed += pending.pop(0)
+            placeholder.markdown(displayed + CURSOR)
+            continue
+
+        if item is _DONE:
+            break
+        if isinstance(item, Exception):
+            raise item
+
+        if not full_response:
+            on_first_token()
+        full_response += item
+        displayed += "".join(pending)
+        pending = _WORD_RE.findall(item)
+        displayed += pending.pop(0)
+        placeholder.markdown(displayed + CURSOR)
+
+    return full_response
+
+
+def stream_completion(client, placeholder, typing_effect=False, turn=None, **request):
+    """Pide la respuesta en streaming y la muestra en ``placeholder`` a medida que llega.
+
+    ``request`` son los argumentos de ``client.chat.completions.create``. Con
+    ``typing_effect`` el texto aparece palabra por palabra, pero sin añadir
+    latencia: al terminar la generación se muestra todo lo que falte.
+
+    Devuelve ``(respuesta, stats)``, donde ``stats`` tiene ``request``
+    (segundos hasta que Groq empieza a responder), ``ttft`` (hasta el primer
+    token), ``total`` (hasta el final), ``render`` (dentro de
+    ``placeholder.markdown``), ``updates`` (veces que se actualizó el
+    placeholder) y ``model`` (el que respondió, que puede ser el de respaldo
+    de ``RateLimitedClient``). Con ``turn`` (``sofia.telemetry``) los tiempos
+    se suman a las etapas del turno.
+    """
+    stats = {"request": None, "ttft": None, "total": None, "render": 0.0, "updates": 0,
+             "model": request.get("model")}
+    start = time.perf_counter()
+
+    def on_first_token():
+        stats["ttft"] = time.perf_counter() - start
+
+    stream = _track_model(client.chat.completions.create(stream=True, **request), stats)
+    stats["request"] = time.perf_counter() - start
+    placeholder = ThrottledPlaceholder(placeholder)
+    if typing_effect:
+        full_response = _show_stream_typing(stream, placeholder, on_first_token)
+    else:
+        full_response = _show_stream(stream, placeholder, on_first_token)
+
+    placeholder.flush(full_response)
+    stats["total"] = time.perf_counter() - start
+    stats["render"] = placeholder.seconds
+    stats["updates"] = placeholder.updates
+    if turn is not None:
+        for name in ("request", "ttft", "render"):
+            turn.add(name, stats[name])
+        turn.add("generate", stats["total"])
+    logger.info(
+        "Respuesta de %s: primer token en %s s, total %.2f s, %d actualizaciones",
+        stats["model"],
+        f"{stats['ttft']:.2f}" if stats["ttft"] is not None else "-",
+        stats["total"],
+        stats["updates"],
+    )
+    return full_response, stats
@@ -0,0 +1,243 @@
+"""Tiempos de cada etapa de un turno y métricas exportables.
+
+Un turno (una pregunta y su respuesta) se mide por etapas:
+
+- ``pdf_load``: carga e indexado de la guía (una vez por proceso),
+- ``topic_filter``: filtro local de preguntas fuera de tema,
+- ``route``: elección del modelo en modo automático,
+- ``retrieve``, ``compress`` y ``prompt``: búsqueda, compresión y armado de los mensajes,
+- ``request``: desde la petición hasta que Groq empieza a responder (incluye la
+  espera del limitador),
+- ``ttft``: hasta el primer token,
+- ``generate``: hasta el último token,
+- ``render``: tiempo dentro de ``placeholder.markdown``,
+- ``turn``: el turno completo.
+
+Al terminar cada turno se escribe una línea JSON en el logger
+``sofia.telemetry`` (etapas en milisegundos, modelo, tokens de entrada y de
+salida) y los tiempos se acumulan en histogramas de ``TELEMETRY``, que se
+exportan en el formato de texto de Prometheus: en ``GET /metrics`` de la API o,
+para las apps de Streamlit, en un servidor aparte en ``SOFIA_METRICS_PORT``.
+
+Streamlit y uvicorn no configuran el logging de la aplicación, así que las
+apps llaman a ``configure_logging`` para que esas líneas (y las decisiones del
+filtro de tema) se escriban en la salida de error con nivel ``SOFIA_LOG_LEVEL``.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sofia.groq_client import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Límites superiores (segundos) de los buckets de los histogramas
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PORT = int(os.getenv("SOFIA_METRICS_PORT", "0"))  # 0 = sin servidor de métricas
+LOG_LEVEL = os.getenv("SOFIA_LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def configure_logging(level=LOG_LEVEL):
+    """Escribe los logs del paquete ``sofia`` aunque nadie haya configurado el logging.
+
+    Añade un solo handler al logger ``sofia`` aunque se llame en cada rerun de
+    Streamlit, y no propaga al logger raíz para no duplicar líneas si este
+    también tiene uno.
+    """
+    sofia_logger = logging.getLogger("sofia")
+    sofia_logger.setLevel(level)
+    if not any(getattr(handler, "sofia", False) for handler in sofia_logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.sofia = True
+        sofia_logger.addHandler(handler)
+    sofia_logger.propagate = False
+
+
+class Histogram:
+    """Histograma acumulado por buckets, como los de Prometheus"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Cuantil estimado por interpolación dentro del bucket (como ``histogram_quantile``)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Turn:
+    """Tiempos y datos de un turno; ``finish`` los registra"""
+
+    def __init__(self, telemetry, **fields):
+        self.telemetry = telemetry
+        self.fields = fields
+        self.stages = {}
+        self._start = time.perf_counter()
+        self._finished = False
+
+    @contextmanager
+    def stage(self, name):
+        """Mide el bloque como la etapa ``name`` (se suma si se repite)"""
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        if seconds is not None:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def finish(self, **fields):
+        """Cierra el turno: registra sus etapas y escribe la línea JSON (solo la primera vez)"""
+        if self._finished:
+            return
+        self._finished = True
+        self.fields.update(fields)
+        self.stages["turn"] = time.perf_counter() - self._start
+        self.telemetry.record(self)
+
+
+def stage(turn, name):
+    """``turn.stage(name)``, o nada si no se está midiendo el turno"""
+    return turn.stage(name) if turn is not None else nullcontext()
+
+
+class Telemetry:
+    """Histogramas por etapa y contadores de turnos y tokens, seguros entre hilos"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.tokens = {}  # (modelo, "prompt" | "completion") -> tokens
+        self.turns = {}  # (modelo, resultado) -> turnos
+
+    def turn(self, **fields):
+        return Turn(self, **fields)
+
+    def _histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self.buckets)
+        return self.histograms[name]
+
+    def observe(self, name, seconds):
+        """Registra una etapa suelta, fuera de un turno (por ejemplo ``pdf_load``)"""
+        with self.lock:
+            self._histogram(name).observe(seconds)
+
+    def record(self, turn):
+        model = turn.fields.get("model") or "none"
+        with self.lock:
+            for name, seconds in turn.stages.items():
+                self._histogram(name).observe(seconds)
+            for kind in ("prompt", "completion"):
+                tokens = turn.fields.get(f"{kind}_tokens")
+                if tokens:
+                    self.tokens[model, kind] = self.tokens.get((model, kind), 0) + tokens
+            outcome = turn.fields.get("outcome", "answered")
+            self.turns[model, outcome] = self.turns.get((model, outcome), 0) + 1
+
+        logger.info(json.dumps(
+            {
+                "event": "turn",
+                **turn.fields,
+                "stages_ms": {name: round(seconds * 1000, 2) for name, seconds in turn.stages.items()},
+            },
+            ensure_ascii=False,
+            default=str,
+        ))
+
+    def summary(self, quantiles=(0.5, 0.95, 0.99)):
+        """``{etapa: {"count": n, "p50": s, ...}}`` con los cuantiles estimados"""
+        with self.lock:
+            return {
+                name: {"count": histogram.count,
+                       **{f"p{round(q * 100)}": histogram.quantile(q) for q in quantiles}}
+                for name, histogram in sorted(self.histograms.items())
+            }
+
+    def prometheus(self, metrics=METRICS):
+        """Métricas en el formato de texto de Prometheus"""
+        lines = [
+            "# HELP sofia_stage_seconds Duración de cada etapa de un turno",
+            "# TYPE sofia_stage_seconds histogram",
+        ]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'sofia_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'sofia_stage_seconds_sum{{stage="{name}"}} {histogram.sum!r}')
+                lines.append(f'sofia_stage_seconds_count{{stage="{name}"}} {histogram.count}')
+
+            lines += ["# HELP sofia_tokens_total Tokens por modelo", "# TYPE sofia_tokens_total counter"]
+            for (model, kind), tokens in sorted(self.tokens.items()):
+                lines.append(f'sofia_tokens_total{{model="{model}",kind="{kind}"}} {tokens}')
+
+            lines += ["# HELP sofia_turns_total Turnos por modelo y resultado", "# TYPE sofia_turns_total counter"]
+            for (model, outcome), count in sorted(self.turns.items()):
+                lines.append(f'sofia_turns_total{{model="{model}",outcome="{outcome}"}} {count}')
+
+        lines += ["# HELP sofia_groq_events_total Eventos del cliente de Groq", "# TYPE sofia_groq_events_total counter"]
+        for event, count in sorted(metrics.snapshot().items()):
+            lines.append(f'sofia_groq_events_total{{event="{event}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+# Compartido por todas las sesiones del proceso
+TELEMETRY = Telemetry()
+
+
+def start_metrics_server(port=METRICS_PORT, telemetry=TELEMETRY, host="0.0.0.0"):
+    """Sirve ``GET /metrics`` en un hilo aparte (para las apps de Streamlit)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = telemetry.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Métricas en http://%s:%d/metrics", host, server.server_port)
+    return server
@@ -0,0 +1,72 @@
+"""Conteo de tokens de textos y mensajes para cada modelo.
+
+Si ``tiktoken`` está instalado se usa su codificación ``cl100k_base``, que se
+parece mucho al tokenizador de Llama 3. Si no, se estima a partir del número
+de caracteres.
+"""
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # Dependencia opcional
+    tiktoken = None
+
+# Caracteres por token aproximados cuando no hay tokenizador (texto mixto
+# inglés/español), por prefijo del nombre del modelo
+CHARS_PER_TOKEN = {
+    "llama-3": 3.8,
+}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+# Tokens de formato que añade la plantilla de chat por cada mensaje
+TOKENS_PER_MESSAGE = 4
+
+# Ventana de contexto de cada modelo
+CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+    "llama-3.1-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # Sin red para descargar la codificación se usa la estimación
+        return None
+
+
+def _chars_per_token(model):
+    for prefix, ratio in CHARS_PER_TOKEN.items():
+        if model and model.startswith(prefix):
+            return ratio
+    return DEFAULT_CHARS_PER_TOKEN
+
+
+def estimate_tokens(text):
+    """Estima cuántos tokens ocupa el texto sin depender del modelo (rápido y estable)"""
+    return math.ceil(len(text) / DEFAULT_CHARS_PER_TOKEN)
+
+
+def count_tokens(text, model=None):
+    """Cuenta los tokens del texto para ``model``"""
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / _chars_per_token(model))
+
+
+def count_message_tokens(messages, model=None):
+    """Cuenta los tokens de una lista de mensajes de chat"""
+    return sum(count_tokens(msg["content"], model) + TOKENS_PER_MESSAGE for msg in messages)
+
+
+def context_window(model):
+    """Tamaño de la ventana de contexto del modelo"""
+    return CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
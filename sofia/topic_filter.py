@@ -0,0 +1,109 @@
+"""Filtro local de preguntas fuera de tema, antes de llamar al modelo.
+
+Una pregunta ajena al SOP ("¿cuál es la capital de Francia?") se contestaba
+con el prompt completo, la guía y una respuesta del modelo grande solo para
+recibir la negativa fija de las reglas. ``TopicFilter`` la detecta en
+microsegundos con los términos normalizados de la pregunta:
+
+1. Con turnos anteriores la pregunta siempre pasa: "explícamelo de otra
+   forma" o "gracias" siguen la conversación.
+2. Si la pregunta tiene algún término del dominio (``CORE_TERMS``, las
+   palabras clave de ``sofia/keywords.json`` y los temas guiados) pasa.
+3. Si no tiene ningún término claramente ajeno (``OFF_TOPIC_TERMS``: poemas,
+   fútbol, programación...) pasa: la guía está en inglés y su vocabulario
+   no basta para decir que una pregunta en español no es del tema.
+4. Si lo tiene, pasa solo si al menos ``THRESHOLD`` de sus términos (sin
+   contar números) aparecen en el vocabulario de la guía.
+
+Solo se rechaza con evidencia de que la pregunta es de otro tema; ante la
+duda pasa y el modelo decide. Cada decisión se registra en el logger
+``sofia.topic_filter`` para poder ajustar el umbral.
+"""
+import hashlib
+import logging
+from collections import Counter
+
+from sofia.normalize import analyze
+from sofia.topics import TOPICS
+
+logger = logging.getLogger(__name__)
+
+THRESHOLD = 0.34
+# Un término de la guía cuenta como vocabulario si aparece en al menos estos chunks
+MIN_DOC_FREQ = 2
+
+# Términos del SOP y de la salud de la mujer que siempre cuentan como del tema
+CORE_TERMS = """
+sop pcos síndrome ovario ovarios poliquístico poliquística quiste quistes mujer mujeres
+menstruación menstrual regla periodo período ciclo sangrado ovulación ovular útero endometrio
+hormona hormonas andrógenos testosterona hirsutismo vello pelo acné alopecia cabello piel
+acantosis manchas ginecólogo ginecóloga endocrinólogo endocrinóloga médico médica doctora salud
+síntoma cuerpo embarazada hijos metformina inositol letrozol clomifeno colesterol corazón
+presión apnea sueño cansancio fatiga antojos azúcar hambre alimentos suplementos vitamina
+autoestima tristeza triste ansiosa estrés guía dolor duele cabeza días cólicos hinchazón
+inflamación granos engordar ayuno pastilla pastillas medicina medicinas dosis análisis estudios
+ultrasonido sangre cirugía enfermedad riesgo cáncer tiroides grasa calorías carbohidratos
+proteína gimnasio caminar dormir
+baja bajado bajar atraso retraso meses embarazo embarazarme fertilidad infertilidad anticonceptivos
+peso sobrepeso obesidad gorda gordo adelgazar kilos dieta ejercicio
+miedo siento fatal deprimida depresión ansiedad angustia llorar lloro vergüenza culpa sola
+preocupada preocupa nerviosa agotada insegura novio pareja
+""".split()
+
+# Términos que indican claramente otro tema (la pregunta se rechaza si además la guía no la respalda)
+OFF_TOPIC_TERMS = """
+poema poesía canción chiste capital países fútbol mundial película películas videojuego
+programación programar código python javascript matemáticas traducir traduce presidente
+elecciones política bitcoin criptomonedas horóscopo
+""".split()
+
+
+class TopicFilter:
+    """Clasifica preguntas como del tema (SOP) o claramente fuera de él.
+
+    ``documents_terms`` son los términos normalizados de los chunks (o
+    páginas) de la guía y ``keywords`` el mapa de categorías de palabras clave.
+    """
+
+    def __init__(self, documents_terms, keywords=None, topics=TOPICS, threshold=THRESHOLD):
+        doc_freq = Counter()
+        for terms in documents_terms:
+            doc_freq.update(set(terms))
+        self.vocabulary = {term for term, freq in doc_freq.items() if freq >= MIN_DOC_FREQ}
+
+        self.domain = {term for word in CORE_TERMS for term in analyze(word)}
+        for words in (keywords or {}).values():
+            for word in words:
+                self.domain.update(analyze(word))
+        # De los temas guiados solo los términos que también usa la guía ("insulina", "acné"...),
+        # no los verbos genéricos de la pregunta
+        for question in topics.values():
+            self.domain.update(term for term in analyze(question) if term in self.vocabulary)
+
+        self.off_topic = {term for word in OFF_TOPIC_TERMS for term in analyze(word)} - self.domain
+        self.threshold = threshold
+
+    def check(self, question, follow_up=False):
+        """Devuelve ``(del_tema, detalle)``; ``detalle`` explica la decisión.
+
+        Con ``follow_up`` (hay turnos anteriores) la pregunta siempre pasa.
+        """
+        terms = {term for term in analyze(question) if not term.isdigit()}
+        if follow_up:
+            on_topic, details = True, {"reason": "follow_up", "score": 1.0}
+        elif terms & self.domain:
+            on_topic, details = True, {"reason": "domain", "score": 1.0}
+        elif not terms & self.off_topic:
+            on_topic, details = True, {"reason": "no_evidence", "score": 1.0}
+        else:
+            score = len(terms & self.vocabulary) / len(terms)
+            on_topic, details = score >= self.threshold, {"reason": "vocabulary", "score": round(score, 3)}
+        details["terms"] = len(terms)
+
+        # Sin el texto de la pregunta: solo su longitud y un hash para agrupar repeticiones
+        logger.info(
+            "topic_filter decision=%s reason=%s score=%.3f terms=%d chars=%d question_hash=%s",
+            "allow" if on_topic else "reject", details["reason"], details["score"], details["terms"],
+            len(question), hashlib.sha256(question.encode("utf-8")).hexdigest()[:12],
+        )
+        return on_topic, details
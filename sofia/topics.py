@@ -0,0 +1,19 @@
+"""Temas guiados del menú lateral: nombre visible -> pregunta que se envía."""
+
+TOPICS = {
+    "🔍 ¿Qué es el SOP?": "Explícame qué es el Síndrome de Ovario Poliquístico",
+    "🩺 ¿Cómo se diagnostica?": "¿Cómo sé si tengo SOP? ¿Qué exámenes necesito?",
+    "💊 Opciones de tratamiento": "¿Cuáles son los tratamientos disponibles para el SOP?",
+    "🥗 Alimentación saludable": "¿Qué debo comer si tengo SOP?",
+    "🏃‍♀️ Actividad física": "¿Qué tipo de ejercicio me ayuda con el SOP?",
+    "⚖️ Manejo del peso": "Tengo dificultad para bajar de peso, ¿qué puedo hacer?",
+    "💉 Resistencia a la insulina": "¿Qué es la resistencia a la insulina en el SOP?",
+    "🤰 Fertilidad y embarazo": "Quiero tener hijos, ¿el SOP afecta mi fertilidad?",
+    "💇‍♀️ Acné y vello excesivo": "¿Cómo manejo el acné y el exceso de vello?",
+    "📅 Períodos irregulares": "Mis períodos son irregulares, ¿es normal?",
+    "🧠 Salud emocional": "Me siento triste o ansiosa, ¿tiene relación con el SOP?",
+    "❤️ Salud del corazón": "¿Debo preocuparme por mi salud cardiovascular?",
+    "🩸 Diabetes y SOP": "¿Tengo mayor riesgo de diabetes?",
+    "💊 Anticonceptivos": "¿Los anticonceptivos ayudan con el SOP?",
+    "🌿 Suplementos naturales": "¿Hay suplementos que puedan ayudarme?",
+}
@@ -0,0 +1,49 @@
+"""Historial del chat en pantalla con ventana de mensajes.
+
+En cada rerun de Streamlit solo se dibujan los últimos ``TRANSCRIPT_WINDOW``
+mensajes; los anteriores quedan detrás de un botón "Ver mensajes anteriores".
+Así el tiempo de dibujo y lo que viaja al navegador no crecen con la
+conversación. El historial se dibuja dentro de un fragmento: pulsar el botón
+solo vuelve a ejecutar el historial, no toda la app.
+"""
+import streamlit as st
+
+TRANSCRIPT_WINDOW = 20  # Mensajes visibles por defecto
+TRANSCRIPT_PAGE = 20  # Mensajes que se añaden cada vez que se pide ver más
+
+_VISIBLE_KEY = "transcript_visible"
+
+# st.fragment existe desde Streamlit 1.37; en versiones anteriores se dibuja sin fragmento
+_fragment = getattr(st, "fragment", lambda func: func)
+
+
+def _show_earlier(page):
+    st.session_state[_VISIBLE_KEY] = st.session_state.get(_VISIBLE_KEY, TRANSCRIPT_WINDOW) + page
+
+
+def reset_transcript():
+    """Vuelve a la ventana por defecto (nueva conversación)"""
+    st.session_state.pop(_VISIBLE_KEY, None)
+
+
+def render_transcript(messages, window=TRANSCRIPT_WINDOW, page=TRANSCRIPT_PAGE):
+    """Dibuja los últimos mensajes de ``messages`` con un botón para ver los anteriores"""
+    # Copia: al volver a ejecutar solo el fragmento no deben aparecer los mensajes
+    # que esta misma ejecución dibuja después, fuera del historial
+    _render(tuple(messages), window, page)
+
+
+@_fragment
+def _render(messages, window, page):
+    visible = st.session_state.setdefault(_VISIBLE_KEY, window)
+    hidden = max(0, len(messages) - visible)
+    if hidden:
+        st.button(
+            f"⬆️ Ver mensajes anteriores ({hidden} ocultos)",
+            key="transcript_show_earlier",
+            on_click=_show_earlier,
+            args=(page,),
+        )
+    for msg in messages[hidden:]:
+        with st.chat_message(msg["role"]):
+            st.markdown(msg["content"])
@@ -0,0 +1,199 @@
+"""Índice TF-IDF con hashing guardado como matrices NumPy mapeadas en memoria.
+
+Alternativa a ``BM25Index`` pensada para bibliotecas de varias guías. Cada
+palabra y cada par de palabras seguidas se asigna a una de ``2**HASH_BITS``
+columnas con CRC32 (no hace falta guardar vocabulario) y la matriz
+documentos × columnas se guarda por columnas, como una matriz dispersa CSC, en
+archivos ``.npy``. Los procesos que la abren con ``mmap_mode="r"`` comparten una
+sola copia en la caché de páginas del sistema y ninguno la reconstruye. Junto a
+las matrices se guarda de qué guía salieron (``source``), para borrar solo las
+versiones viejas de esa misma guía.
+
+Una búsqueda es un único producto matriz-vector disperso: se toman las columnas
+de los términos de la pregunta y se suman por documento con ``np.bincount``.
+"""
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zlib
+from collections import Counter
+
+import numpy as np
+
+from sofia.chunking import chunk_text
+from sofia.normalize import NORMALIZER_VERSION
+from sofia.pdf_loader import CACHE_DIR
+from sofia.retrieval import document_terms
+
+logger = logging.getLogger(__name__)
+
+# Cambia este número si cambia la forma de construir la matriz
+INDEX_VERSION = 1
+HASH_BITS = 18  # 262 144 columnas
+NGRAMS = 2  # Palabras sueltas y pares de palabras seguidas
+VECTOR_CACHE_DIR = os.path.join(CACHE_DIR, "vectors")
+
+_ARRAYS = ("indptr", "doc_ids", "weights", "idf")
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+_SOURCE_FILE = "source.txt"
+
+
+def _features(terms, ngrams=NGRAMS):
+    """Palabras y n-gramas (hasta ``ngrams`` palabras) de una lista de términos"""
+    features = list(terms)
+    for n in range(2, ngrams + 1):
+        features.extend(" ".join(terms[i:i + n]) for i in range(len(terms) - n + 1))
+    return features
+
+
+def _buckets(features, hash_bits):
+    """Columna de cada término (CRC32: igual en todos los procesos, a diferencia de ``hash``)"""
+    mask = (1 << hash_bits) - 1
+    return Counter(zlib.crc32(feature.encode("utf-8")) & mask for feature in features)
+
+
+def documents_key(documents, hash_bits=HASH_BITS, ngrams=NGRAMS):
+    """Clave de la matriz: cambia si cambia el texto de algún documento o los parámetros"""
+    digest = hashlib.sha256(f"{INDEX_VERSION}-{NORMALIZER_VERSION}-{hash_bits}-{ngrams}".encode("utf-8"))
+    for doc in documents:
+        digest.update(b"\x1f")
+        digest.update(chunk_text(doc).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _prune(cache_dir, keep, source):
+    """Borra las matrices de ``source`` salvo ``keep`` (otra versión de la guía o de los parámetros).
+
+    Las de otras guías se dejan. Los procesos que aún tengan mapeada una
+    matriz borrada siguen leyéndola hasta cerrarla.
+    """
+    for name in os.listdir(cache_dir):
+        if name == keep or not _KEY_RE.fullmatch(name):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            with open(os.path.join(path, _SOURCE_FILE), encoding="utf-8") as file:
+                same_source = file.read() == source
+        except OSError:
+            continue
+        if same_source:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class TfidfIndex:
+    """Matriz TF-IDF dispersa (por columnas) con la misma interfaz que ``BM25Index``"""
+
+    def __init__(self, documents, indptr, doc_ids, weights, idf, hash_bits=HASH_BITS, ngrams=NGRAMS):
+        self.documents = documents
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.weights = weights
+        self.idf = idf
+        self.hash_bits = hash_bits
+        self.ngrams = ngrams
+
+    @classmethod
+    def build(cls, documents, hash_bits=HASH_BITS, ngrams=NGRAMS):
+        """Construye la matriz en memoria"""
+        dim = 1 << hash_bits
+        num_docs = len(documents)
+        doc_buckets = [_buckets(_features(document_terms(doc), ngrams), hash_bits) for doc in documents]
+
+        rows = np.fromiter(
+            (doc_id for doc_id, buckets in enumerate(doc_buckets) for _ in buckets), dtype=np.int32
+        )
+        cols = np.fromiter((col for buckets in doc_buckets for col in buckets), dtype=np.int64)
+        tf = np.fromiter((count for buckets in doc_buckets for count in buckets.values()), dtype=np.float32)
+
+        doc_freq = np.bincount(cols, minlength=dim)
+        idf = (np.log((1 + num_docs) / (1 + doc_freq)) + 1).astype(np.float32)
+
+        # TF sublineal × IDF, normalizado (L2) por documento
+        weights = (1 + np.log(tf)) * idf[cols]
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=num_docs))
+        weights = (weights / np.maximum(norms[rows], 1e-12)).astype(np.float32)
+
+        order = np.argsort(cols, kind="stable")
+        indptr = np.zeros(dim + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=indptr[1:])
+        return cls(documents, indptr, rows[order], weights[order], idf, hash_bits, ngrams)
+
+    @classmethod
+    def load(cls, documents, source=None, cache_dir=VECTOR_CACHE_DIR, hash_bits=HASH_BITS, ngrams=NGRAMS):
+        """Abre la matriz de ``documents`` desde disco (mapeada) o la construye y la guarda.
+
+        ``source`` identifica la guía (por ejemplo la ruta del PDF): al guardar
+        una matriz nueva se borran las anteriores de la misma guía.
+        """
+        path = os.path.join(cache_dir, documents_key(documents, hash_bits, ngrams))
+        try:
+            arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+            return cls(documents, hash_bits=hash_bits, ngrams=ngrams, **arrays)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning("Matriz TF-IDF ilegible (%s), se reconstruye: %s", path, e)
+
+        index = cls.build(documents, hash_bits, ngrams)
+        index.save(path, source)
+        return index
+
+    def save(self, path, source=None):
+        """Guarda las matrices en el directorio ``path`` de forma atómica"""
+        parent = os.path.dirname(path)
+        try:
+            os.makedirs(parent, exist_ok=True)
+            tmp_path = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+            try:
+                for name in _ARRAYS:
+                    np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+                if source is not None:
+                    with open(os.path.join(tmp_path, _SOURCE_FILE), "w", encoding="utf-8") as file:
+                        file.write(source)
+                os.chmod(tmp_path, 0o755)
+                if os.path.isdir(path):
+                    # Otro proceso la guardó mientras tanto (o estaba incompleta)
+                    shutil.rmtree(path, ignore_errors=True)
+                os.replace(tmp_path, path)
+            except BaseException:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                raise
+        except OSError as e:
+            # Sin disco escribible se sigue usando la matriz en memoria
+            logger.warning("No se pudo guardar la matriz TF-IDF en %s: %s", path, e)
+            return
+
+        if source is not None:
+            _prune(parent, os.path.basename(path), source)
+
+    def search(self, terms, top_k=3):
+        """Devuelve hasta ``top_k`` pares (puntuación, id de documento), de mayor a menor"""
+        query = _buckets(_features(list(terms), self.ngrams), self.hash_bits)
+        cols = np.fromiter(query, dtype=np.int64, count=len(query))
+        starts = self.indptr[cols]
+        lengths = self.indptr[cols + 1] - starts
+        keep = lengths > 0
+        if not keep.any():
+            return []
+        cols, starts, lengths = cols[keep], starts[keep], lengths[keep]
+        tf = np.fromiter((query[col] for col in cols), dtype=np.float32, count=len(cols))
+        query_weights = (1 + np.log(tf)) * self.idf[cols]
+
+        # Posiciones de todas las entradas de esas columnas, sin bucle en Python
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+        scores = np.bincount(
+            self.doc_ids[positions],
+            weights=self.weights[positions] * np.repeat(query_weights, lengths),
+            minlength=len(self.documents),
+        )
+
+        top_k = min(top_k, np.count_nonzero(scores))
+        if not top_k:
+            return []
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(float(scores[doc_id]), int(doc_id)) for doc_id in best]
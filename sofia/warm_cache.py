@@ -0,0 +1,78 @@
+"""Precalcula las respuestas de los temas guiados de bot3.0.py.
+
+Uso::
+
+    python -m sofia.warm_cache                      # modelo por defecto
+    python -m sofia.warm_cache --model llama-3.1-8b-instant --force
+
+Las respuestas quedan en la caché de respuestas y la app las muestra al
+instante cuando alguien elige el tema, sin gastar cuota de la API.
+"""
+import argparse
+import logging
+import os
+import sys
+
+from dotenv import load_dotenv
+from groq import Groq
+
+from sofia.answer_cache import DEFAULT_TTL, AnswerCache
+from sofia.groq_client import RateLimitedClient
+from sofia.pipeline import MAX_TOKENS, MODEL, PDF_PATH, TEMPERATURE, ChatPipeline
+from sofia.prompts import PROMPT_VERSION
+from sofia.topics import TOPICS
+
+logger = logging.getLogger(__name__)
+
+
+def warm_topics(client, pipeline, model, cache, force=False):
+    """Genera y guarda la respuesta de cada tema guiado que no esté ya en la caché"""
+    guide_hash = pipeline.guide_hash
+    generated = 0
+    for name, question in TOPICS.items():
+        if not force and cache.get(question, model, guide_hash, PROMPT_VERSION) is not None:
+            logger.info("Ya en caché: %s", name)
+            continue
+
+        completion = client.chat.completions.create(
+            model=model,
+            messages=pipeline.build_messages([{"role": "user", "content": question}], model),
+            temperature=TEMPERATURE,
+            max_tokens=MAX_TOKENS,
+        )
+        cache.put(question, model, guide_hash, PROMPT_VERSION, completion.choices[0].message.content)
+        generated += 1
+        logger.info("Generada: %s", name)
+    return generated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--pdf", default=PDF_PATH, help="ruta de la guía PDF")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL, help="segundos de validez")
+    parser.add_argument("--force", action="store_true", help="regenerar aunque ya estén en caché")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    load_dotenv()
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        logger.error("Falta la variable de entorno GROQ_API_KEY")
+        return 1
+
+    pipeline = ChatPipeline(args.pdf)
+    cache = AnswerCache(ttl=args.ttl)
+    removed = cache.invalidate(guide_hash=pipeline.guide_hash)
+    if removed:
+        logger.info("Borradas %d respuestas obsoletas", removed)
+
+    # Sin modelo de respaldo: la respuesta guardada debe ser del modelo pedido
+    client = RateLimitedClient(Groq(api_key=api_key, max_retries=0), fallback=False)
+    generated = warm_topics(client, pipeline, args.model, cache, force=args.force)
+    logger.info("%d respuestas nuevas en %s", generated, cache.cache_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())